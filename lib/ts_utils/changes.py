@@ -0,0 +1,110 @@
+"""Work out which parts of typeshed are affected by the changes since a git revision."""
+
+from __future__ import annotations
+
+import subprocess
+from collections import defaultdict
+from collections.abc import Iterable
+from dataclasses import dataclass
+from pathlib import PurePosixPath
+
+from .metadata import read_dependencies
+from .paths import STDLIB_PATH, STUBS_PATH, TESTS_DIR
+
+__all__ = ["ChangedTargets", "changed_files", "changed_targets", "reverse_dependencies"]
+
+# Changes to these files and directories can affect the results of every test.
+GLOBAL_INPUTS = frozenset({"lib", "tests", "pyproject.toml", "requirements-tests.txt"})
+
+
+@dataclass(frozen=True)
+class ChangedTargets:
+    """The distributions and test case directories that need to be tested after a change."""
+
+    everything: bool = False
+    stdlib_tests: bool = False
+    distributions: frozenset[str] = frozenset()
+
+    def includes_stdlib(self) -> bool:
+        return self.everything
+
+    def includes_stdlib_tests(self) -> bool:
+        return self.everything or self.stdlib_tests
+
+    def includes_distribution(self, distribution: str) -> bool:
+        return self.everything or distribution in self.distributions
+
+    def describe(self) -> str:
+        if self.everything:
+            return "everything"
+        targets = sorted(self.distributions)
+        if self.stdlib_tests:
+            targets.insert(0, "stdlib test cases")
+        return ", ".join(targets) if targets else "nothing"
+
+
+def changed_files(revision: str) -> list[PurePosixPath]:
+    """Return the files that differ between the merge base of `revision` and the working tree.
+
+    Untracked files that are not ignored by git are included.
+    """
+    commands = [
+        ["git", "diff", "--name-only", "--no-renames", "--merge-base", revision, "--"],
+        ["git", "ls-files", "--others", "--exclude-standard"],
+    ]
+    files: list[PurePosixPath] = []
+    for command in commands:
+        try:
+            proc = subprocess.run(command, capture_output=True, text=True, check=True)
+        except subprocess.CalledProcessError as e:
+            raise RuntimeError(f"Failed to find the files changed since {revision!r}: {e.stderr.strip()}") from None
+        files.extend(PurePosixPath(line) for line in proc.stdout.splitlines() if line)
+    return files
+
+
+def reverse_dependencies() -> dict[str, set[str]]:
+    """Map each typeshed distribution to the distributions that directly depend on it."""
+    dependents: defaultdict[str, set[str]] = defaultdict(set)
+    for dist_path in STUBS_PATH.iterdir():
+        if not (dist_path / "METADATA.toml").is_file():
+            continue
+        for requirement in read_dependencies(dist_path.name).typeshed_pkgs:
+            dependents[requirement.name].add(dist_path.name)
+    return dependents
+
+
+def _with_dependents(distributions: Iterable[str]) -> frozenset[str]:
+    dependents = reverse_dependencies()
+    selected = set(distributions)
+    stack = list(selected)
+    while stack:
+        for dependent in dependents.get(stack.pop(), ()):
+            if dependent not in selected:
+                selected.add(dependent)
+                stack.append(dependent)
+    return frozenset(selected)
+
+
+def changed_targets(revision: str) -> ChangedTargets:
+    """Return what needs to be tested after the changes made since `revision`.
+
+    A change to a distribution also selects all distributions that depend on it,
+    directly or indirectly.
+    A change to the stdlib stubs (but not only to the stdlib test cases or allowlists)
+    or to the test scripts selects everything.
+    Removed distributions are not selected.
+    """
+    stdlib_tests = False
+    distributions: set[str] = set()
+    for path in changed_files(revision):
+        top_level, *rest = path.parts
+        if top_level in GLOBAL_INPUTS:
+            return ChangedTargets(everything=True)
+        if top_level == STDLIB_PATH.name:
+            if rest[:1] != [TESTS_DIR]:
+                return ChangedTargets(everything=True)
+            stdlib_tests = True
+        elif top_level == STUBS_PATH.name and len(rest) > 1:
+            distributions.add(rest[0])
+    existing = {dist for dist in _with_dependents(distributions) if (STUBS_PATH / dist / "METADATA.toml").is_file()}
+    return ChangedTargets(stdlib_tests=stdlib_tests, distributions=frozenset(existing))
@@ -0,0 +1,125 @@
+"""The import graph of stub files, for splitting them into groups that can be type checked separately."""
+
+from __future__ import annotations
+
+import ast
+from collections.abc import Mapping
+from pathlib import Path
+
+from .paths import TS_BASE_PATH
+from .timings import partition
+
+__all__ = ["import_graph", "partition_modules", "resolve_import_from", "strongly_connected_components", "stub_imports"]
+
+
+def resolve_import_from(module: str, node: ast.ImportFrom, *, is_package: bool) -> str | None:
+    """Return the absolute name of the module in a `from` import, or None if a relative import goes too far up."""
+    if not node.level:
+        assert node.module is not None
+        return node.module
+    parts = module.split(".")
+    # Relative to the package itself in __init__.pyi, and to the containing package otherwise
+    base = parts[: len(parts) - node.level + is_package]
+    if not base:
+        return None  # Invalid, and reported by the type checkers
+    return ".".join([*base, node.module] if node.module else base)
+
+
+def stub_imports(module: str, path: Path) -> set[str]:
+    """Return the names of all modules that a stub file imports, and the possible modules of `from` imports.
+
+    Imports in all branches of `if` statements are included, whatever the Python version or platform.
+    Raise SyntaxError if the stub file can't be parsed.
+    """
+    is_package = path.name == "__init__.pyi"
+    tree = ast.parse((TS_BASE_PATH / path).read_text(encoding="UTF-8"), str(path))
+    imports: set[str] = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            imports.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            target = resolve_import_from(module, node, is_package=is_package)
+            if target is None:
+                continue
+            imports.add(target)
+            imports.update(f"{target}.{alias.name}" for alias in node.names)
+    return imports
+
+
+def import_graph(modules: Mapping[str, Path]) -> dict[str, set[str]]:
+    """Return the modules that each module depends on, given the stub files of all modules.
+
+    Like mypy, a module depends on the modules it imports, on their parent packages and on its own
+    parent packages. Only dependencies between the given modules are included.
+    """
+    graph: dict[str, set[str]] = {}
+    for module, path in modules.items():
+        dependencies = {"builtins"}
+        for imported in [*stub_imports(module, path), module]:
+            parts = imported.split(".")
+            dependencies.update(".".join(parts[:end]) for end in range(1, len(parts) + 1))
+        dependencies.discard(module)
+        graph[module] = dependencies & modules.keys()
+    return graph
+
+
+def strongly_connected_components(graph: Mapping[str, set[str]]) -> list[list[str]]:
+    """Return the strongly connected components of a graph, dependencies first.
+
+    This is Tarjan's algorithm, without recursion so that long import chains don't hit the recursion limit.
+    The modules in each component are sorted.
+    """
+    index: dict[str, int] = {}
+    lowlink: dict[str, int] = {}
+    stack: list[str] = []
+    on_stack: set[str] = set()
+    components: list[list[str]] = []
+    for root in sorted(graph):
+        if root in index:
+            continue
+        work = [(root, iter(sorted(graph[root])))]
+        index[root] = lowlink[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        while work:
+            node, successors = work[-1]
+            for successor in successors:
+                if successor not in index:
+                    index[successor] = lowlink[successor] = len(index)
+                    stack.append(successor)
+                    on_stack.add(successor)
+                    work.append((successor, iter(sorted(graph[successor]))))
+                    break
+                if successor in on_stack:
+                    lowlink[node] = min(lowlink[node], index[successor])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+                if lowlink[node] == index[node]:
+                    component: list[str] = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.remove(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    components.append(sorted(component))
+    return components
+
+
+def partition_modules(modules: Mapping[str, Path], num_shards: int) -> list[list[Path]]:
+    """Split stub files into `num_shards` groups of similar total size, keeping import cycles together.
+
+    mypy checks the modules of an import cycle together, even if only some of them are being tested,
+    so splitting a cycle between groups would mean checking it more than once.
+    Groups can be empty if there are fewer import cycles than shards.
+    The result only depends on the stub files, so separate processes agree on it.
+    """
+    components = strongly_connected_components(import_graph(modules))
+    sizes = {
+        tuple(component): sum((TS_BASE_PATH / modules[module]).stat().st_size for module in component) for component in components
+    }
+    shards = partition([tuple(component) for component in components], num_shards, sizes.__getitem__)
+    return [sorted(modules[module] for component in shard for module in component) for shard in shards]
@@ -0,0 +1,144 @@
+"""A manifest of all stub files in typeshed, shared by the scripts and kept between runs."""
+
+from __future__ import annotations
+
+import bisect
+import functools
+import json
+import os
+import threading
+from collections.abc import Iterable
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, cast
+
+from .paths import CACHE_PATH, STDLIB_PATH, STUBS_PATH, TS_BASE_PATH
+
+__all__ = ["MANIFEST_PATH", "Manifest", "StubFile", "get_manifest"]
+
+MANIFEST_PATH = CACHE_PATH / "manifest.json"
+# Increment this when the format of the manifest file changes
+_MANIFEST_FORMAT = 1
+
+
+@dataclass(frozen=True)
+class StubFile:
+    """A `.pyi` file in the stdlib or in the stubs of a third-party distribution."""
+
+    path: Path  # relative to the root of typeshed, e.g. stubs/requests/requests/api.pyi
+    module: str
+    distribution: str | None  # None for the stdlib
+    mtime_ns: int
+
+
+def _module_name(parts: tuple[str, ...]) -> str:
+    """Return the module name of a stub file, given its path relative to the stdlib or distribution directory."""
+    *packages, filename = parts
+    if filename != "__init__.pyi":
+        packages.append(filename.removesuffix(".pyi"))
+    return ".".join(packages)
+
+
+def _stub_file(path: str, mtime_ns: int) -> StubFile:
+    parts = tuple(path.split("/"))
+    if parts[0] == STDLIB_PATH.name:
+        return StubFile(Path(path), _module_name(parts[1:]), None, mtime_ns)
+    return StubFile(Path(path), _module_name(parts[2:]), parts[1], mtime_ns)
+
+
+class Manifest:
+    """All `.pyi` files in the stdlib and stubs directories, sorted by path."""
+
+    def __init__(self, files: Iterable[StubFile]) -> None:
+        self.files = sorted(files, key=lambda file: file.path.as_posix())
+        self._keys = [file.path.as_posix() for file in self.files]
+
+    def files_in(self, path: Path) -> list[StubFile]:
+        """Return the stub files in a directory (recursively), or the stub file at `path`."""
+        prefix = path.as_posix()
+        start = bisect.bisect_left(self._keys, prefix)
+        end = bisect.bisect_left(self._keys, prefix + "/\uffff", lo=start)
+        return [
+            file
+            for key, file in zip(self._keys[start:end], self.files[start:end], strict=True)
+            if key == prefix or key.startswith(f"{prefix}/")
+        ]
+
+    def stdlib_files(self) -> list[StubFile]:
+        return self.files_in(STDLIB_PATH)
+
+    def distribution_files(self, distribution: str) -> list[StubFile]:
+        return self.files_in(STUBS_PATH / distribution)
+
+    @classmethod
+    def load(cls, path: Path = MANIFEST_PATH) -> Manifest:
+        """Return the manifest of the current tree, reusing the directory listings saved by earlier runs.
+
+        A directory is only listed again if its mtime changed (i.e. if entries were added, removed or renamed).
+        Files are still stat-ed, so that their mtimes are up to date even if they were edited in place.
+        The manifest file is updated if anything changed.
+        """
+        try:
+            data = cast(dict[str, Any], json.loads(path.read_text(encoding="UTF-8")))
+        except (OSError, ValueError):
+            data = {}
+        cached: dict[str, dict[str, Any]] = data.get("directories", {}) if data.get("format") == _MANIFEST_FORMAT else {}
+
+        directories: dict[str, dict[str, Any]] = {}
+        files: list[StubFile] = []
+        to_visit = [STDLIB_PATH.as_posix(), STUBS_PATH.as_posix()]
+        while to_visit:
+            directory = to_visit.pop()
+            listing = _revalidate(directory, cached.get(directory))
+            if listing is None:
+                continue
+            directories[directory] = listing
+            to_visit.extend(f"{directory}/{name}" for name in listing["dirs"])
+            files.extend(_stub_file(f"{directory}/{name}", mtime_ns) for name, mtime_ns in listing["files"].items())
+
+        if directories != cached:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_suffix(f".{os.getpid()}-{threading.get_ident()}.tmp")
+            tmp_path.write_text(json.dumps({"format": _MANIFEST_FORMAT, "directories": directories}), encoding="UTF-8")
+            tmp_path.replace(path)
+        return cls(files)
+
+
+def _revalidate(directory: str, listing: dict[str, Any] | None) -> dict[str, Any] | None:
+    """Return an up-to-date listing of the subdirectories and stub files of a directory, or None if it doesn't exist."""
+    root = TS_BASE_PATH / directory
+    try:
+        mtime_ns = root.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+    if listing is not None and listing["mtime"] == mtime_ns:
+        try:
+            return {**listing, "files": {name: (root / name).stat().st_mtime_ns for name in listing["files"]}}
+        except FileNotFoundError:
+            pass  # Removed while we were looking; list the directory again
+    dirs: list[str] = []
+    stub_files: dict[str, int] = {}
+    with os.scandir(root) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                dirs.append(entry.name)
+            elif entry.name.endswith(".pyi") and entry.is_file():
+                stub_files[entry.name] = entry.stat().st_mtime_ns
+    return {"mtime": mtime_ns, "dirs": sorted(dirs), "files": dict(sorted(stub_files.items()))}
+
+
+_manifest_lock = threading.Lock()
+
+
+@functools.cache
+def _load_manifest() -> Manifest:
+    return Manifest.load()
+
+
+def get_manifest() -> Manifest:
+    """Return the manifest of all stub files, loading it only once per process.
+
+    Threads that need the manifest while it's being loaded wait for it, instead of loading it as well.
+    """
+    with _manifest_lock:
+        return _load_manifest()
@@ -0,0 +1,93 @@
+"""Keep the memory usage of concurrently running test tasks within a budget."""
+
+from __future__ import annotations
+
+import re
+import threading
+from collections.abc import Generator
+from contextlib import contextmanager
+from pathlib import Path
+
+from .paths import CACHE_PATH
+from .timings import Timings
+
+__all__ = ["PEAK_MEMORY_PATH", "MemoryBudget", "PeakMemory", "parse_memory_size"]
+
+PEAK_MEMORY_PATH = CACHE_PATH / "peak_memory.json"
+# The assumed peak memory usage of a mypy run, before any run has been measured
+DEFAULT_TASK_MEMORY = 512 * 1024**2
+
+_UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+
+
+def parse_memory_size(size: str) -> int:
+    """Parse a memory size like "512M" or "4G" into a number of bytes.
+
+    Units are binary, so "1K" is 1024 bytes. A trailing "B" or "iB" is allowed.
+    """
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMGT]?)(?:i?B)?\s*", size, re.IGNORECASE)
+    if match is None:
+        raise ValueError(f"Invalid memory size: {size!r}")
+    return int(float(match[1]) * _UNITS[match[2].upper()])
+
+
+class PeakMemory:
+    """The peak memory usage (RSS, in bytes) of the tasks of one test runner, as recorded by earlier runs.
+
+    The measurements are stored like `Timings`, in a separate file.
+    If a task is measured more than once in a run, e.g. for several Python versions, the largest measurement is kept.
+    """
+
+    def __init__(self, runner: str, path: Path = PEAK_MEMORY_PATH) -> None:
+        self._measurements = Timings(runner, path, default=DEFAULT_TASK_MEMORY)
+        self._lock = threading.Lock()
+        self._peaks: dict[str, float] = {}
+
+    def estimate(self, task: str) -> float:
+        """Return the expected peak memory usage of a task, in bytes."""
+        return self._measurements.estimate(task)
+
+    def record(self, task: str, peak_rss: float) -> None:
+        with self._lock:
+            self._peaks[task] = max(peak_rss, self._peaks.get(task, 0))
+            self._measurements.record(task, self._peaks[task])
+
+    def save(self) -> None:
+        """Merge the measurements of this run into the peak memory file."""
+        self._measurements.save()
+
+
+class MemoryBudget:
+    """An admission controller that only lets tasks start while their estimated memory usage fits into a budget.
+
+    The memory usage of a task is estimated from the peak memory usage recorded for it by earlier runs.
+    A task that needs more than the whole budget is only started when no other task is running.
+    Without a limit, tasks are never held back.
+    """
+
+    def __init__(self, limit: int | None, peak_memory: PeakMemory) -> None:
+        self.limit = limit
+        self.peak_memory = peak_memory
+        self._in_use = 0
+        self._condition = threading.Condition()
+
+    @contextmanager
+    def reserve(self, *tasks: str) -> Generator[None]:
+        """Wait until the memory for running the tasks together fits into the budget, and reserve it until the context exits.
+
+        Tasks that are run together, e.g. in one mypy run, are assumed to need as much memory as the largest of them.
+        """
+        if self.limit is None:
+            yield
+            return
+        limit = self.limit
+        amount = min(int(max(self.peak_memory.estimate(task) for task in tasks)), limit)
+        with self._condition:
+            self._condition.wait_for(lambda: self._in_use == 0 or self._in_use + amount <= limit)
+            self._in_use += amount
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._in_use -= amount
+                self._condition.notify_all()
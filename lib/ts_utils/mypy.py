@@ -1,8 +1,16 @@
 from __future__ import annotations
 
+import hashlib
+import json
+import os
+import shutil
+import subprocess
 import sys
-from collections.abc import Generator, Iterable
+import tempfile
+import time
+from collections.abc import Callable, Generator, Iterable, Sequence
 from contextlib import contextmanager
+from pathlib import Path
 from typing import Any, NamedTuple
 
 if sys.version_info >= (3, 11):
@@ -10,8 +18,17 @@ if sys.version_info >= (3, 11):
 else:
     import tomli as tomllib
 
+from ts_utils.manifest import get_manifest
 from ts_utils.metadata import StubtestSettings, metadata_path
-from ts_utils.utils import NamedTemporaryFile, TemporaryFileWrapper
+from ts_utils.paths import CACHE_PATH, STDLIB_PATH, TESTS_DIR
+from ts_utils.stdlib_versions import get_stdlib_versions_index
+from ts_utils.utils import FileLock, NamedTemporaryFile, TemporaryFileWrapper, hardlink_copytree, tree_digest, tree_size
+
+STDLIB_CACHE_DIR = CACHE_PATH / "mypy-stdlib"
+# Least recently used stdlib caches are removed when they take up more than this
+MAX_STDLIB_CACHE_SIZE = 1024**3
+
+_STDLIB_CACHE_MARKER = "typeshed-stdlib-cache.json"
 
 
 class MypyDistConf(NamedTuple):
@@ -79,3 +96,137 @@ def temporary_mypy_config_file(
         yield temp
     finally:
         temp.close()
+
+
+def _stdlib_cache_is_valid(cache_dir: Path) -> bool:
+    return (cache_dir / _STDLIB_CACHE_MARKER).is_file()
+
+
+def copy_prewarmed_stdlib_cache(
+    flags: Sequence[str],
+    version: str,
+    destination: Path,
+    *,
+    directory: Path = STDLIB_CACHE_DIR,
+    log: Callable[[str], object] | None = None,
+) -> None:
+    """Copy a mypy cache in which all stdlib modules have already been analysed into `destination`.
+
+    The cache is built the first time it's needed, by running mypy with the given flags
+    on a module that imports every stdlib module available for the target Python version.
+    The flags must include the `--custom-typeshed-dir` that the cache will be used with,
+    since mypy rehashes every file whose path differs from the one recorded in the cache.
+    The caches are kept in `directory`, keyed by the contents of the stdlib stubs (not their tests),
+    the mypy version and the flags, so they are reused by later runs until any of these change.
+    The least recently used caches are removed when they take up more than `MAX_STDLIB_CACHE_SIZE`.
+
+    Since mypy writes cache files by replacing them, rather than modifying them in place,
+    the copy is made with `hardlink_copytree`, and mypy must be run on it with `--no-sqlite-cache`.
+
+    Raise RuntimeError if the cache couldn't be built.
+    """
+    from mypy.version import __version__ as mypy_version
+
+    flags = list(flags)
+    if "--config-file" in flags:
+        # The config file only contains sections for the distribution's own modules
+        config_index = flags.index("--config-file")
+        flags = flags[:config_index] + flags[config_index + 2 :]
+    key_data = json.dumps([tree_digest(STDLIB_PATH, TESTS_DIR), mypy_version, flags])
+    key = hashlib.sha256(key_data.encode()).hexdigest()[:16]
+    cache_dir = directory / key
+
+    # Held while copying, so that the cache isn't evicted by a concurrent test run in the meantime
+    lock = FileLock(directory / f"{key}.lock")
+    while True:
+        lock.acquire(shared=True)
+        if _stdlib_cache_is_valid(cache_dir):
+            break
+        lock.release()
+        with FileLock(lock.path):
+            if not _stdlib_cache_is_valid(cache_dir):
+                if log is not None:
+                    log(f"Building stdlib mypy cache in {cache_dir}")
+                _build_stdlib_cache(cache_dir, flags, version)
+                _evict_stdlib_caches(directory)
+    try:
+        hardlink_copytree(cache_dir, destination)
+        # Record the time of use for the LRU eviction
+        (cache_dir / _STDLIB_CACHE_MARKER).touch()
+    finally:
+        lock.release()
+
+
+def _build_stdlib_cache(cache_dir: Path, flags: list[str], version: str) -> None:
+    major, minor = version.split(".")
+    version_files = get_stdlib_versions_index().files_for_version((int(major), int(minor)))
+    modules = [file.module for file in get_manifest().stdlib_files() if file.path in version_files]
+    if cache_dir.exists():
+        shutil.rmtree(cache_dir)
+    with tempfile.TemporaryDirectory(dir=cache_dir.parent) as td:
+        source_dir = Path(td, "src")
+        source_dir.mkdir()
+        prewarm_module = source_dir / "_typeshed_stdlib_prewarm.pyi"
+        prewarm_module.write_text("".join(f"import {module}\n" for module in modules), encoding="UTF-8")
+        new_cache_dir = Path(td, "cache")
+        mypy_command = [
+            sys.executable,
+            "-m",
+            "mypy",
+            *flags,
+            "--no-sqlite-cache",
+            "--cache-dir",
+            str(new_cache_dir),
+            str(prewarm_module),
+        ]
+        env_vars = dict(os.environ, MYPYPATH=str(source_dir))
+        result = subprocess.run(mypy_command, capture_output=True, text=True, env=env_vars, check=False)
+        # Exit code 1 only means that mypy found errors, which doesn't stop it from writing the cache
+        if result.returncode not in (0, 1):
+            raise RuntimeError(f"Failed to build the stdlib mypy cache (exit code {result.returncode})\n{result.stderr}")
+        marker = {"size": tree_size(new_cache_dir), "created": time.time()}
+        (new_cache_dir / _STDLIB_CACHE_MARKER).write_text(json.dumps(marker), encoding="UTF-8")
+        new_cache_dir.rename(cache_dir)
+
+
+def _evict_stdlib_caches(directory: Path) -> None:
+    """Remove the least recently used stdlib caches in `directory` until they fit into `MAX_STDLIB_CACHE_SIZE`.
+
+    Caches that are being copied, or still being built, are never removed.
+    """
+    entries: list[tuple[float, int, Path]] = []
+    for cache_dir in directory.iterdir():
+        marker_path = cache_dir / _STDLIB_CACHE_MARKER
+        try:
+            size = json.loads(marker_path.read_text(encoding="UTF-8"))["size"]
+            last_used = marker_path.stat().st_mtime
+        except (OSError, ValueError, KeyError):
+            continue  # Not a cache, or one that's still being built
+        entries.append((last_used, size, cache_dir))
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, cache_dir in sorted(entries):
+        if total_size <= MAX_STDLIB_CACHE_SIZE:
+            break
+        lock = FileLock(directory / f"{cache_dir.name}.lock")
+        if not lock.acquire(blocking=False):
+            continue
+        try:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+        finally:
+            lock.release()
+        total_size -= size
+
+
+def run_mypy_in_worker(mypy_args: list[str], mypypath: str | None) -> tuple[str, str, int]:
+    """Run mypy in a long-lived worker process, which only has to import mypy once.
+
+    Each worker only runs one task at a time,
+    so it's safe to set MYPYPATH in the worker's environment.
+    """
+    import mypy.api
+
+    if mypypath is None:
+        os.environ.pop("MYPYPATH", None)
+    else:
+        os.environ["MYPYPATH"] = mypypath
+    return mypy.api.run(mypy_args)
@@ -13,6 +13,8 @@ PYPROJECT_PATH: Final = TS_BASE_PATH / "pyproject.toml"
 REQUIREMENTS_PATH: Final = TS_BASE_PATH / "requirements-tests.txt"
 GITIGNORE_PATH: Final = TS_BASE_PATH / ".gitignore"
 PYRIGHT_CONFIG: Final = TS_BASE_PATH / "pyrightconfig.stricter.json"
+# Persistent caches used by the test scripts
+CACHE_PATH: Final = TS_BASE_PATH / ".typeshed_cache"
 
 TESTS_DIR: Final = "@tests"
 TEST_CASES_DIR: Final = "test_cases"
@@ -0,0 +1,253 @@
+"""Find out whether type checking a distribution's stubs can give different results on different platforms."""
+
+from __future__ import annotations
+
+import ast
+import functools
+from collections import defaultdict
+from collections.abc import Iterable
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TypeAlias
+
+from .import_graph import resolve_import_from
+from .manifest import get_manifest
+from .metadata import get_recursive_requirements
+from .paths import TS_BASE_PATH
+
+__all__ = ["COLLAPSED_PLATFORM", "PlatformSensitivity", "platform_dependent_stdlib_names", "platform_sensitivity"]
+
+# The platform that platform-insensitive distributions are tested on when the platform matrix is collapsed
+COLLAPSED_PLATFORM = "linux"
+
+_Name: TypeAlias = tuple[str, str]  # A module and a name defined in it
+
+
+def _platform_check(node: ast.AST) -> ast.expr | None:
+    """Return the first `sys.platform` (or `platform`, imported from sys) in a syntax tree, if any."""
+    for child in ast.walk(node):
+        if isinstance(child, ast.Attribute) and child.attr == "platform":
+            return child
+        if isinstance(child, ast.Name) and child.id == "platform" and isinstance(child.ctx, ast.Load):
+            return child
+    return None
+
+
+@functools.cache
+def _stdlib_modules() -> frozenset[str]:
+    return frozenset(file.module for file in get_manifest().stdlib_files())
+
+
+class _StubAnalysis:
+    """The names that a stub file (or test case file) defines and imports, and the stdlib names it refers to."""
+
+    def __init__(self, module: str, path: Path) -> None:
+        self.module = module
+        self.is_package = path.name == "__init__.pyi"
+        self.tree = ast.parse((TS_BASE_PATH / path).read_text(encoding="UTF-8"), path.as_posix())
+        self.module_aliases: dict[str, str] = {}
+        self.imported: dict[str, _Name] = {}
+        self.star_imports: list[str] = []
+        self.definitions: defaultdict[str, list[ast.stmt]] = defaultdict(list)
+        # Names that are defined under a platform check, or whose definition contains one
+        self.conditional: set[str] = set()
+        self._visit(self.tree.body, conditional=False)
+
+    def _visit(self, statements: list[ast.stmt], *, conditional: bool) -> None:
+        for statement in statements:
+            if isinstance(statement, ast.If):
+                branch_conditional = conditional or _platform_check(statement.test) is not None
+                self._visit(statement.body, conditional=branch_conditional)
+                self._visit(statement.orelse, conditional=branch_conditional)
+                continue
+            for name in self._bind(statement):
+                self.definitions[name].append(statement)
+                if conditional or _platform_check(statement) is not None:
+                    self.conditional.add(name)
+
+    def _bind(self, statement: ast.stmt) -> list[str]:
+        """Record the imports of a statement, and return the names that the statement binds."""
+        if isinstance(statement, (ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)):
+            return [statement.name]
+        if isinstance(statement, (ast.Assign, ast.AnnAssign)):
+            targets = statement.targets if isinstance(statement, ast.Assign) else [statement.target]
+            return [node.id for target in targets for node in ast.walk(target) if isinstance(node, ast.Name)]
+        if isinstance(statement, ast.Import):
+            names: list[str] = []
+            for alias in statement.names:
+                if alias.asname is None:
+                    # `import a.b` binds `a`, and a.b is found by following the attribute
+                    top_level = alias.name.partition(".")[0]
+                    self.module_aliases[top_level] = top_level
+                    names.append(top_level)
+                else:
+                    self.module_aliases[alias.asname] = alias.name
+                    names.append(alias.asname)
+            return names
+        if isinstance(statement, ast.ImportFrom):
+            target = resolve_import_from(self.module, statement, is_package=self.is_package)
+            if target is None:
+                return []
+            names = []
+            for alias in statement.names:
+                if alias.name == "*":
+                    self.star_imports.append(target)
+                    continue
+                local_name = alias.asname or alias.name
+                if f"{target}.{alias.name}" in _stdlib_modules():
+                    self.module_aliases[local_name] = f"{target}.{alias.name}"
+                else:
+                    self.imported[local_name] = (target, alias.name)
+                names.append(local_name)
+            return names
+        return []
+
+    def references(self, node: ast.AST) -> tuple[set[_Name], set[str]]:
+        """Return the names that a syntax tree refers to, and the modules that it uses as values."""
+        names: set[_Name] = set()
+        modules: set[str] = set()
+        attribute_values = {id(child.value) for child in ast.walk(node) if isinstance(child, ast.Attribute)}
+        for child in ast.walk(node):
+            if isinstance(child, ast.Attribute):
+                resolved = self._resolve_attribute(child)
+                if resolved is not None:
+                    names.add(resolved)
+            elif isinstance(child, ast.Name) and isinstance(child.ctx, ast.Load):
+                if child.id in self.module_aliases:
+                    if id(child) not in attribute_values:
+                        modules.add(self.module_aliases[child.id])
+                elif child.id in self.imported:
+                    names.add(self.imported[child.id])
+                elif child.id in self.definitions:
+                    names.add((self.module, child.id))
+                else:
+                    names.add(("builtins", child.id))
+        return names, modules
+
+    def _resolve_attribute(self, node: ast.Attribute) -> _Name | None:
+        """Return the name that an attribute of a module (e.g. `os.path.join`) refers to."""
+        parts: list[str] = []
+        value: ast.expr = node
+        while isinstance(value, ast.Attribute):
+            parts.insert(0, value.attr)
+            value = value.value
+        if not isinstance(value, ast.Name) or value.id not in self.module_aliases:
+            return None
+        module = self.module_aliases[value.id]
+        for part in parts:
+            if f"{module}.{part}" not in _stdlib_modules():
+                return module, part
+            module = f"{module}.{part}"
+        return None
+
+
+@functools.cache
+def platform_dependent_stdlib_names() -> frozenset[_Name]:
+    """Return the names in the stdlib stubs whose definitions can differ between platforms.
+
+    These are the names that are defined under `sys.platform` checks, or whose definitions contain them,
+    e.g. classes with platform-specific methods, and everything that refers to these names
+    (e.g. subclasses, re-exports and functions that use them in their signatures), transitively.
+
+    Raise SyntaxError if a stdlib stub can't be parsed.
+    """
+    dependent: set[_Name] = set()
+    referrers: defaultdict[_Name, set[_Name]] = defaultdict(set)
+    star_importers: defaultdict[str, set[str]] = defaultdict(set)
+    for file in get_manifest().stdlib_files():
+        analysis = _StubAnalysis(file.module, file.path)
+        dependent.update((file.module, name) for name in analysis.conditional)
+        for name, statements in analysis.definitions.items():
+            references: set[_Name] = {analysis.imported[name]} if name in analysis.imported else set()
+            for statement in statements:
+                references |= analysis.references(statement)[0]
+            for reference in references:
+                referrers[reference].add((file.module, name))
+        for imported_module in analysis.star_imports:
+            star_importers[imported_module].add(file.module)
+
+    to_visit = list(dependent)
+    while to_visit:
+        module, name = to_visit.pop()
+        for referrer in [*referrers[module, name], *((importer, name) for importer in star_importers[module])]:
+            if referrer not in dependent:
+                dependent.add(referrer)
+                to_visit.append(referrer)
+    return frozenset(dependent)
+
+
+@functools.cache
+def _stdlib_names_or_error() -> frozenset[_Name] | SyntaxError:
+    try:
+        return platform_dependent_stdlib_names()
+    except SyntaxError as e:
+        return e
+
+
+@functools.cache
+def _file_sensitivity(module: str, path: Path) -> str | None:
+    """Return why type checking a file can give different results on different platforms, or None if it can't.
+
+    Files that can't be parsed count as platform-sensitive, and are left for the type checker to report.
+    """
+    try:
+        analysis = _StubAnalysis(module, path)
+    except SyntaxError as e:
+        return f"line {e.lineno} can't be parsed"
+    check = _platform_check(analysis.tree)
+    if check is not None:
+        return f"line {check.lineno} checks sys.platform"
+    dependent = _stdlib_names_or_error()
+    if isinstance(dependent, SyntaxError):
+        return f"the stdlib stubs can't be analysed ({dependent.filename}, line {dependent.lineno} can't be parsed)"
+    dependent_modules = {module for module, _ in dependent}
+    names, modules = analysis.references(analysis.tree)
+    names.update(analysis.imported.values())
+    modules.update(analysis.star_imports)
+    for name in sorted(names & dependent):
+        return f"uses {'.'.join(name)}, which depends on the platform"
+    for used_module in sorted(modules & dependent_modules):
+        return f"uses the module {used_module}, which has platform-dependent definitions"
+    return None
+
+
+@dataclass(frozen=True)
+class PlatformSensitivity:
+    """Whether type checking the stubs of a distribution can give different results on different platforms."""
+
+    distribution: str
+    reason: str | None  # None if the results are the same on all platforms
+
+    @property
+    def sensitive(self) -> bool:
+        return self.reason is not None
+
+    def describe(self) -> str:
+        if self.reason is None:
+            return f"{self.distribution} doesn't depend on the platform"
+        return f"{self.distribution} depends on the platform: {self.reason}"
+
+
+def platform_sensitivity(distribution: str, extra_files: Iterable[Path] = ()) -> PlatformSensitivity:
+    """Work out whether type checking a distribution can give different results on different platforms.
+
+    The stubs of the distribution and of its typeshed dependencies are checked, and `extra_files`
+    (e.g. test cases) if given. The analysis is conservative: a distribution only counts as
+    platform-insensitive if none of these files check `sys.platform` or use any platform-dependent
+    stdlib names, and if it has no non-types dependencies, whose sources aren't analysed.
+    """
+    requirements = get_recursive_requirements(distribution)
+    if requirements.external_pkgs:
+        names = ", ".join(sorted(requirement.name for requirement in requirements.external_pkgs))
+        return PlatformSensitivity(distribution, f"it has non-types dependencies ({names})")
+    manifest = get_manifest()
+    for stubs in [distribution, *sorted(requirement.name for requirement in requirements.typeshed_pkgs)]:
+        for file in manifest.distribution_files(stubs):
+            reason = _file_sensitivity(file.module, file.path)
+            if reason is not None:
+                return PlatformSensitivity(distribution, f"{file.path.as_posix()}: {reason}")
+    for path in extra_files:
+        reason = _file_sensitivity("__main__", path)
+        if reason is not None:
+            return PlatformSensitivity(distribution, f"{path.as_posix()}: {reason}")
+    return PlatformSensitivity(distribution, None)
@@ -0,0 +1,155 @@
+"""Aggregate the timing statistics of many mypy runs, to find the stubs that are most expensive to type check."""
+
+from __future__ import annotations
+
+import json
+import threading
+from collections import defaultdict
+from collections.abc import Iterable
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TypeVar
+
+from .manifest import get_manifest
+from .paths import CACHE_PATH
+
+__all__ = ["PROFILE_PATH", "Profile", "read_line_checking_stats", "read_timing_stats"]
+
+PROFILE_PATH = CACHE_PATH / "profile.json"
+
+_TIMING_STATS = "timing-stats.txt"
+_LINE_CHECKING_STATS = "line-checking-stats.txt"
+
+_K = TypeVar("_K")
+
+
+def read_timing_stats(path: Path) -> dict[str, float]:
+    """Read the file written by mypy's --timing-stats, returning the time spent on each module in milliseconds."""
+    stats: dict[str, float] = {}
+    for line in path.read_text(encoding="UTF-8").splitlines():
+        module, _, microseconds = line.rpartition(" ")
+        if module:
+            stats[module] = int(microseconds) / 1000
+    return stats
+
+
+def read_line_checking_stats(path: Path) -> dict[tuple[str, int], float]:
+    """Read the file written by mypy's --line-checking-stats, returning the time spent on each line in milliseconds."""
+    stats: dict[tuple[str, int], float] = {}
+    module = None
+    for line in path.read_text(encoding="UTF-8").splitlines():
+        if line.endswith(":"):
+            module = line[:-1]
+        elif module is not None and line.strip():
+            lineno, microseconds = line.split()
+            stats[module, int(lineno)] = float(microseconds) / 1000
+    return stats
+
+
+@dataclass
+class _Cost:
+    total: float = 0.0  # in milliseconds
+    runs: int = 0
+
+    def add(self, milliseconds: float) -> None:
+        self.total += milliseconds
+        self.runs += 1
+
+
+class Profile:
+    """The time that mypy spent on each stub module and line, summed over all runs for each Python version and platform.
+
+    Every mypy run checks the stubs it imports, e.g. `builtins`, again,
+    so the totals show how much each stub costs all of its users together.
+    Only modules in typeshed's stubs are counted, not those of non-types dependencies.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._modules: defaultdict[tuple[str, str], defaultdict[str, _Cost]] = defaultdict(lambda: defaultdict(_Cost))
+        self._lines: defaultdict[tuple[str, str], defaultdict[tuple[str, int], _Cost]] = defaultdict(lambda: defaultdict(_Cost))
+        self._module_paths: dict[str, Path] = {}
+        for file in get_manifest().files:
+            # Prefer the stdlib, which mypy also prefers
+            if file.distribution is None or file.module not in self._module_paths:
+                self._module_paths[file.module] = file.path
+
+    @staticmethod
+    def mypy_flags(stats_dir: Path) -> list[str]:
+        """Return the flags that make mypy write its statistics files into `stats_dir`.
+
+        Modules loaded from mypy's cache aren't checked, so the cache is not read.
+        """
+        return [
+            "--no-incremental",
+            "--timing-stats",
+            str(stats_dir / _TIMING_STATS),
+            "--line-checking-stats",
+            str(stats_dir / _LINE_CHECKING_STATS),
+        ]
+
+    def add_run(self, version: str, platform: str, stats_dir: Path) -> None:
+        """Add the statistics that one mypy run, started with `mypy_flags(stats_dir)`, wrote.
+
+        Missing files, e.g. after a crash, are ignored.
+        """
+        timing_stats, line_checking_stats = stats_dir / _TIMING_STATS, stats_dir / _LINE_CHECKING_STATS
+        modules = read_timing_stats(timing_stats) if timing_stats.exists() else {}
+        lines = read_line_checking_stats(line_checking_stats) if line_checking_stats.exists() else {}
+        with self._lock:
+            for module, milliseconds in modules.items():
+                if module in self._module_paths:
+                    self._modules[version, platform][module].add(milliseconds)
+            for (module, lineno), milliseconds in lines.items():
+                if module in self._module_paths:
+                    self._lines[version, platform][module, lineno].add(milliseconds)
+
+    def _ranked_versions(self) -> list[tuple[str, str, list[tuple[str, _Cost]], list[tuple[str, _Cost]]]]:
+        """Return the modules and lines of each Python version and platform, most expensive first."""
+        with self._lock:
+            return [
+                (
+                    version,
+                    platform,
+                    _ranked(self._modules[version, platform]),
+                    [
+                        (f"{self._module_paths[module].as_posix()}:{lineno}", cost)
+                        for (module, lineno), cost in _ranked(self._lines[version, platform])
+                    ],
+                )
+                for version, platform in sorted(self._modules.keys() | self._lines.keys())
+            ]
+
+    def format_report(self, top: int = 20) -> str:
+        """Return tables of the most expensive modules and lines for each Python version and platform."""
+        sections: list[str] = []
+        for version, platform, modules, lines in self._ranked_versions():
+            sections.append(f"--- Python {version} on {platform}: the {top} most expensive stub modules ---")
+            sections.append(_table("module", modules[:top]))
+            sections.append(f"--- Python {version} on {platform}: the {top} most expensive lines ---")
+            sections.append(_table("line", lines[:top]))
+        return "\n".join(sections)
+
+    def write_json(self, path: Path = PROFILE_PATH) -> None:
+        """Write the totals of all modules and lines to a JSON file, most expensive first."""
+        data = [
+            {
+                "version": version,
+                "platform": platform,
+                "modules": [{"module": name, "total_ms": cost.total, "runs": cost.runs} for name, cost in modules],
+                "lines": [{"line": name, "total_ms": cost.total, "runs": cost.runs} for name, cost in lines],
+            }
+            for version, platform, modules, lines in self._ranked_versions()
+        ]
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(data, indent=2) + "\n", encoding="UTF-8")
+
+
+def _ranked(costs: dict[_K, _Cost]) -> list[tuple[_K, _Cost]]:
+    return sorted(costs.items(), key=lambda item: item[1].total, reverse=True)
+
+
+def _table(what: str, rows: Iterable[tuple[str, _Cost]]) -> str:
+    lines = [f"{'total ms':>10} {'runs':>6} {'mean ms':>9}  {what}"]
+    lines.extend(f"{cost.total:10.1f} {cost.runs:6} {cost.total / cost.runs:9.2f}  {name}" for name, cost in rows)
+    return "\n".join(lines)
@@ -0,0 +1,170 @@
+"""Machine-readable reports of test runs, with the duration and resource usage of each task."""
+
+from __future__ import annotations
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+from collections.abc import Mapping, Sequence
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Literal, TypeAlias
+from xml.etree import ElementTree
+
+__all__ = ["MeasuredProcess", "Report", "ResourceUsage", "TaskReport", "TaskStatus", "process_usage", "run_measured"]
+
+TaskStatus: TypeAlias = Literal["success", "failure", "crash", "skipped"]
+
+
+@dataclass(frozen=True)
+class ResourceUsage:
+    """The resources used by a child process."""
+
+    cpu_time: float  # user + system time, in seconds
+    peak_rss: int  # in bytes
+
+
+class MeasuredProcess(subprocess.CompletedProcess[str]):
+    """A finished process, together with the resources it used, if they could be measured."""
+
+    def __init__(self, args: Sequence[str], returncode: int, stdout: str, stderr: str, usage: ResourceUsage | None) -> None:
+        super().__init__(args, returncode, stdout, stderr)
+        self.usage = usage
+
+
+def process_usage(process: subprocess.CompletedProcess[str]) -> ResourceUsage | None:
+    return process.usage if isinstance(process, MeasuredProcess) else None
+
+
+def run_measured(
+    command: Sequence[str], *, env: Mapping[str, str] | None = None, cwd: Path | None = None, capture_output: bool = True
+) -> MeasuredProcess:
+    """Run a command like `subprocess.run(command, capture_output=True, text=True)`, measuring its resource usage.
+
+    If `capture_output` is False, the output of the command isn't captured, and is empty in the result.
+    The process is reaped with `os.wait4()`, so the usage is that of this child (and its waited-for children) only,
+    even if other tasks run concurrently in other threads.
+    Where `os.wait4()` isn't available, the usage is `None`.
+    """
+    if not hasattr(os, "wait4"):
+        proc = subprocess.run(command, capture_output=capture_output, text=True, env=env, cwd=cwd, check=False)
+        return MeasuredProcess(proc.args, proc.returncode, proc.stdout or "", proc.stderr or "", None)
+
+    # Output goes to temporary files rather than pipes, so that we don't need to read
+    # the pipes while waiting for the process (which subprocess.communicate() would reap itself).
+    with tempfile.TemporaryFile("w+") as stdout, tempfile.TemporaryFile("w+") as stderr:
+        popen = subprocess.Popen(
+            command,
+            stdout=stdout if capture_output else None,
+            stderr=stderr if capture_output else None,
+            text=True,
+            env=env,
+            cwd=cwd,
+        )
+        _, status, rusage = os.wait4(popen.pid, 0)
+        popen.returncode = os.waitstatus_to_exitcode(status)
+        stdout.seek(0)
+        stderr.seek(0)
+        # ru_maxrss is in kilobytes on Linux, but in bytes on macOS
+        peak_rss = rusage.ru_maxrss if sys.platform == "darwin" else rusage.ru_maxrss * 1024
+        usage = ResourceUsage(cpu_time=rusage.ru_utime + rusage.ru_stime, peak_rss=peak_rss)
+        return MeasuredProcess(list(command), popen.returncode, stdout.read(), stderr.read(), usage)
+
+
+@dataclass(frozen=True)
+class TaskReport:
+    """The outcome of one task of a test run, e.g. checking one distribution for one Python version and platform."""
+
+    name: str
+    version: str
+    platform: str
+    status: TaskStatus
+    exit_code: int | None = None
+    files: int | None = None
+    wall_time: float | None = None
+    cpu_time: float | None = None
+    peak_rss: int | None = None
+    cached: bool = False
+    # The output of failing tasks, or the reason for skipping a task
+    output: str | None = None
+
+
+class Report:
+    """Collect the outcomes of the tasks of a test run, and write them to a JSON or JUnit XML file."""
+
+    def __init__(self, runner: str) -> None:
+        self.runner = runner
+        self._lock = threading.Lock()
+        self.tasks: list[TaskReport] = []
+
+    def add(
+        self,
+        name: str,
+        version: str,
+        platform: str,
+        status: TaskStatus,
+        *,
+        exit_code: int | None = None,
+        files: int | None = None,
+        wall_time: float | None = None,
+        usage: ResourceUsage | None = None,
+        cached: bool = False,
+        output: str | None = None,
+    ) -> None:
+        task = TaskReport(
+            name,
+            version,
+            platform,
+            status,
+            exit_code=exit_code,
+            files=files,
+            wall_time=wall_time,
+            cpu_time=None if usage is None else usage.cpu_time,
+            peak_rss=None if usage is None else usage.peak_rss,
+            cached=cached,
+            output=None if status == "success" else output,
+        )
+        with self._lock:
+            self.tasks.append(task)
+
+    def write(self, json_path: Path | None = None, junit_path: Path | None = None) -> None:
+        if json_path is not None:
+            self.write_json(json_path)
+        if junit_path is not None:
+            self.write_junit(junit_path)
+
+    def write_json(self, path: Path) -> None:
+        data = {"runner": self.runner, "tasks": [asdict(task) for task in self.tasks]}
+        path.write_text(json.dumps(data, indent=2) + "\n", encoding="UTF-8")
+
+    def write_junit(self, path: Path) -> None:
+        suite = ElementTree.Element(
+            "testsuite",
+            name=self.runner,
+            tests=str(len(self.tasks)),
+            failures=str(sum(task.status == "failure" for task in self.tasks)),
+            errors=str(sum(task.status == "crash" for task in self.tasks)),
+            skipped=str(sum(task.status == "skipped" for task in self.tasks)),
+            time=f"{sum(task.wall_time or 0 for task in self.tasks):.3f}",
+        )
+        for task in self.tasks:
+            case = ElementTree.SubElement(
+                suite,
+                "testcase",
+                classname=f"{self.runner}.{task.name}",
+                name=f"Python {task.version} on {task.platform}",
+                time=f"{task.wall_time or 0:.3f}",
+            )
+            if task.status == "failure":
+                ElementTree.SubElement(case, "failure", message=f"exit code {task.exit_code}").text = task.output
+            elif task.status == "crash":
+                ElementTree.SubElement(case, "error", message=f"exit code {task.exit_code}").text = task.output
+            elif task.status == "skipped":
+                ElementTree.SubElement(case, "skipped", message=task.output or "")
+        root = ElementTree.Element("testsuites")
+        root.append(suite)
+        ElementTree.indent(root)
+        ElementTree.ElementTree(root).write(path, encoding="utf-8", xml_declaration=True)
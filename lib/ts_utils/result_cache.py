@@ -0,0 +1,99 @@
+"""A persistent cache of successful test results, keyed by the contents of the inputs of each test."""
+
+from __future__ import annotations
+
+import functools
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+from .metadata import get_recursive_requirements
+from .paths import CACHE_PATH, STDLIB_PATH, TEST_CASES_DIR, TESTS_DIR, distribution_path
+from .utils import parse_requirements, tree_digest
+
+__all__ = [
+    "RESULT_CACHE_PATH",
+    "ResultCache",
+    "distribution_digest",
+    "requirements_digest",
+    "stdlib_digest",
+    "stub_closure_digest",
+]
+
+RESULT_CACHE_PATH = CACHE_PATH / "results"
+
+
+@functools.cache
+def requirements_digest() -> str:
+    """Return a digest of the pinned versions of the tools in the requirements file."""
+    requirements = sorted(str(requirement) for requirement in parse_requirements().values())
+    return hashlib.sha256(json.dumps(requirements).encode()).hexdigest()
+
+
+def stdlib_digest() -> str:
+    """Return a digest of the contents of the stdlib directory."""
+    return tree_digest(STDLIB_PATH)
+
+
+@functools.cache
+def distribution_digest(distribution: str) -> str:
+    """Return a digest of the stubs of a distribution and of all its typeshed dependencies.
+
+    This includes the METADATA.toml files and the @tests directories of the distributions.
+    """
+    closure = sorted({distribution, *(r.name for r in get_recursive_requirements(distribution).typeshed_pkgs)})
+    digests = [[dist, tree_digest(distribution_path(dist))] for dist in closure]
+    return hashlib.sha256(json.dumps(digests).encode()).hexdigest()
+
+
+@functools.cache
+def stub_closure_digest(distribution: str | None) -> str:
+    """Return a digest of the stubs that the test cases of a distribution (or of the stdlib, for None) are checked against.
+
+    This includes the stdlib, and the stubs and METADATA.toml files of the distribution and its typeshed dependencies,
+    but no test cases, so that each test case file can be cached on its own.
+    """
+    test_cases = f"{TESTS_DIR}/{TEST_CASES_DIR}"
+    digests = [["stdlib", tree_digest(STDLIB_PATH, test_cases)]]
+    if distribution is not None:
+        closure = sorted({distribution, *(r.name for r in get_recursive_requirements(distribution).typeshed_pkgs)})
+        digests.extend([dist, tree_digest(distribution_path(dist), test_cases)] for dist in closure)
+    return hashlib.sha256(json.dumps(digests).encode()).hexdigest()
+
+
+class ResultCache:
+    """Remember which tests have passed, so that they can be skipped until one of their inputs changes.
+
+    A cache key should be computed from everything that can change the outcome of a test,
+    e.g. using `distribution_digest()`, `stdlib_digest()`, the target Python version and platform,
+    and the command-line arguments of the test.
+    The pinned versions of typeshed's tools and the contents of the test script
+    are always included in the key.
+    Only successes are cached, so failing tests are always rerun.
+    """
+
+    def __init__(self, script: Path, directory: Path = RESULT_CACHE_PATH) -> None:
+        self.runner = script.stem
+        self.script_digest = hashlib.sha256(script.read_bytes()).hexdigest()
+        self.directory = directory / self.runner
+
+    def key(self, *parts: object) -> str:
+        key_data = json.dumps([self.runner, self.script_digest, requirements_digest(), *parts], default=str)
+        return hashlib.sha256(key_data.encode()).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}.json"
+
+    def is_success(self, key: str) -> bool:
+        return self._path(key).is_file()
+
+    def record_success(self, key: str, **details: object) -> None:
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temporary file first, so that concurrent readers never see a partial file
+        tmp_path = path.with_suffix(f".{os.getpid()}-{threading.get_ident()}.tmp")
+        tmp_path.write_text(json.dumps({"time": time.time(), **details}, default=str), encoding="UTF-8")
+        tmp_path.replace(path)
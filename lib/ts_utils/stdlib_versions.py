@@ -0,0 +1,87 @@
+"""A compiled index of stdlib/VERSIONS, for finding out quickly which stdlib stubs exist in a Python version."""
+
+from __future__ import annotations
+
+import functools
+import threading
+from pathlib import Path
+
+from .manifest import Manifest, get_manifest
+from .utils import SupportedVersionsDict, VersionTuple, parse_stdlib_versions_file
+
+__all__ = ["StdlibVersionsIndex", "get_stdlib_versions_index"]
+
+
+class _TrieNode:
+    def __init__(self) -> None:
+        self.versions: tuple[VersionTuple, VersionTuple] | None = None
+        self.children: dict[str, _TrieNode] = {}
+
+
+class StdlibVersionsIndex:
+    """The supported versions of all stdlib modules, as given by stdlib/VERSIONS.
+
+    The entries of VERSIONS are compiled into a trie of module name components,
+    so that the entry for a module is found with one lookup per component,
+    and the versions of all modules in the stdlib stubs are computed in advance.
+    The stdlib stub files of each Python version are computed once, on first use.
+    """
+
+    def __init__(self, module_versions: SupportedVersionsDict, manifest: Manifest) -> None:
+        self.module_versions = module_versions
+        self._root = _TrieNode()
+        for module, module_range in module_versions.items():
+            node = self._root
+            for part in module.split("."):
+                node = node.children.setdefault(part, _TrieNode())
+            node.versions = module_range
+        self._stdlib_files = manifest.stdlib_files()
+        self._module_versions = {
+            file.module: versions for file in self._stdlib_files if (versions := self._lookup(file.module)) is not None
+        }
+        self._files_by_version: dict[VersionTuple, frozenset[Path]] = {}
+        self._lock = threading.Lock()
+
+    def _lookup(self, module: str) -> tuple[VersionTuple, VersionTuple] | None:
+        """Return the versions of the closest VERSIONS entry for a module or one of its parent packages."""
+        node = self._root
+        versions = None
+        for part in module.split("."):
+            child = node.children.get(part)
+            if child is None:
+                break
+            node = child
+            versions = node.versions or versions
+        return versions
+
+    def supported_versions(self, module: str) -> tuple[VersionTuple, VersionTuple]:
+        """Return the minimum and maximum Python version that a stdlib module is available in.
+
+        Raise ValueError if neither the module nor any of its parent packages is listed in VERSIONS.
+        """
+        versions = self._module_versions.get(module) or self._lookup(module)
+        if versions is None:
+            raise ValueError(f"Module {module!r} is missing from stdlib/VERSIONS")
+        return versions
+
+    def is_supported(self, module: str, version: VersionTuple) -> bool:
+        min_version, max_version = self.supported_versions(module)
+        return min_version <= version <= max_version
+
+    def files_for_version(self, version: VersionTuple) -> frozenset[Path]:
+        """Return the stdlib stub files of the modules that are available in a Python version.
+
+        Raise ValueError if a stub file belongs to a module that isn't covered by VERSIONS.
+        """
+        with self._lock:
+            if version not in self._files_by_version:
+                self._files_by_version[version] = frozenset(
+                    file.path for file in self._stdlib_files if self.is_supported(file.module, version)
+                )
+            return self._files_by_version[version]
+
+
+@functools.cache
+def get_stdlib_versions_index() -> StdlibVersionsIndex:
+    """Return the index of stdlib/VERSIONS, parsing the file only once per process."""
+    return StdlibVersionsIndex(parse_stdlib_versions_file(), get_manifest())
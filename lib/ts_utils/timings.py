@@ -0,0 +1,125 @@
+"""Record how long test tasks take, and use the recorded durations to schedule and shard tasks."""
+
+from __future__ import annotations
+
+import json
+import os
+import threading
+from collections.abc import Callable, Iterable, Sequence
+from pathlib import Path
+from typing import TypeVar, cast
+
+from .paths import CACHE_PATH
+from .utils import FileLock
+
+__all__ = ["TIMINGS_PATH", "Timings", "longest_first", "merge_timings_files", "partition", "shard"]
+
+_T = TypeVar("_T")
+
+TIMINGS_PATH = CACHE_PATH / "timings.json"
+
+
+class Timings:
+    """The durations of the tasks of one test runner, as recorded by earlier runs.
+
+    The file holds the durations of all runners, keyed by runner name and then by task name.
+    Only the most recent duration of each task is kept.
+    Tasks that haven't been timed yet are assumed to take as long as an average task,
+    or `default` seconds if no task has been timed yet.
+    """
+
+    def __init__(self, runner: str, path: Path = TIMINGS_PATH, default: float = 1.0) -> None:
+        self.runner = runner
+        self.path = path
+        self._lock = threading.Lock()
+        self._recorded: dict[str, float] = {}
+        self._durations = _read_timings(path).get(runner, {})
+        self._default = sum(self._durations.values()) / len(self._durations) if self._durations else default
+
+    def estimate(self, task: str) -> float:
+        """Return the expected duration of a task, in seconds."""
+        return self._durations.get(task, self._default)
+
+    def record(self, task: str, duration: float) -> None:
+        with self._lock:
+            self._recorded[task] = duration
+
+    def save(self) -> None:
+        """Merge the durations recorded by this run into the timings file.
+
+        The file is locked while doing so, so that concurrent test runs don't lose each other's durations.
+        """
+        with self._lock:
+            if not self._recorded:
+                return
+            with FileLock(self.path.with_suffix(".lock")):
+                data = _read_timings(self.path)
+                data[self.runner] = {**data.get(self.runner, {}), **self._recorded}
+                _write_timings(self.path, data)
+
+
+def _read_timings(path: Path) -> dict[str, dict[str, float]]:
+    try:
+        data = json.loads(path.read_text(encoding="UTF-8"))
+    except (OSError, ValueError):
+        return {}
+    return cast(dict[str, dict[str, float]], data) if isinstance(data, dict) else {}
+
+
+def _write_timings(path: Path, data: dict[str, dict[str, float]]) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    tmp_path.write_text(json.dumps(data, indent=2, sort_keys=True) + "\n", encoding="UTF-8")
+    tmp_path.replace(path)
+
+
+def merge_timings_files(base: Path, updated: Iterable[Path], destination: Path) -> None:
+    """Merge timings files that were written by runs starting from the same `base` file, such as the shards of a CI job.
+
+    Since each run only records the durations of its own tasks, the durations that differ from `base`
+    are the ones that were recorded, and they replace those in `base`. Missing files are skipped.
+    """
+    base_data = _read_timings(base)
+    data = {runner: dict(durations) for runner, durations in base_data.items()}
+    for path in updated:
+        for runner, durations in _read_timings(path).items():
+            base_durations = base_data.get(runner, {})
+            recorded = {task: duration for task, duration in durations.items() if base_durations.get(task) != duration}
+            data[runner] = {**data.get(runner, {}), **recorded}
+    _write_timings(destination, data)
+
+
+def longest_first(items: Iterable[_T], weight: Callable[[_T], float]) -> list[_T]:
+    """Sort items by descending weight, keeping the original order of items with the same weight.
+
+    Starting the longest tasks first keeps them from ending up at the tail of a worker pool's queue.
+    """
+    return sorted(items, key=weight, reverse=True)
+
+
+def partition(items: Sequence[_T], num_shards: int, weight: Callable[[_T], float]) -> list[list[_T]]:
+    """Split items into `num_shards` shards with total weights as even as possible.
+
+    Uses greedy bin-packing: each item, heaviest first, goes to the currently lightest shard.
+    The result is deterministic, so separate processes that use the same weights agree on it.
+    Each shard keeps the original order of its items.
+    """
+    if num_shards < 1:
+        raise ValueError(f"Number of shards must be positive, not {num_shards}")
+    loads = [0.0] * num_shards
+    assignment: dict[int, int] = {}
+    for index in longest_first(range(len(items)), lambda index: weight(items[index])):
+        lightest = min(range(num_shards), key=loads.__getitem__)
+        assignment[index] = lightest
+        loads[lightest] += weight(items[index])
+    shards: list[list[_T]] = [[] for _ in range(num_shards)]
+    for index, item in enumerate(items):
+        shards[assignment[index]].append(item)
+    return shards
+
+
+def shard(items: Sequence[_T], num_shards: int, shard_index: int, weight: Callable[[_T], float]) -> list[_T]:
+    """Return the items belonging to one shard of `partition()`."""
+    if not 0 <= shard_index < num_shards:
+        raise ValueError(f"Shard index must be between 0 and {num_shards - 1}, not {shard_index}")
+    return partition(items, num_shards, weight)[shard_index]
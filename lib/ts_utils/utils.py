@@ -3,13 +3,17 @@
 from __future__ import annotations
 
 import functools
+import hashlib
+import os
 import re
+import shutil
 import sys
 import tempfile
+import time
 from collections.abc import Iterable, Mapping
 from pathlib import Path
 from types import MethodType
-from typing import TYPE_CHECKING, Any, Final, NamedTuple, TypeAlias
+from typing import TYPE_CHECKING, Any, Final, NamedTuple, TextIO, TypeAlias
 
 import pathspec
 from packaging.requirements import Requirement
@@ -87,16 +91,16 @@ def print_skipped(message: str) -> None:
     print(colored(message, "yellow"))
 
 
-def print_error(error: str, end: str = "\n", fix_path: tuple[str, str] = ("", "")) -> None:
+def print_error(error: str, end: str = "\n", fix_path: tuple[str, str] = ("", ""), file: TextIO | None = None) -> None:
     error_split = error.split("\n")
     old, new = fix_path
     for line in error_split[:-1]:
-        print(colored(line.replace(old, new), "red"))
-    print(colored(error_split[-1], "red"), end=end)
+        print(colored(line.replace(old, new), "red"), file=file)
+    print(colored(error_split[-1], "red"), end=end, file=file)
 
 
-def print_success_msg() -> None:
-    print(colored("success", "green"))
+def print_success_msg(file: TextIO | None = None) -> None:
+    print(colored("success", "green"), file=file)
 
 
 def print_divider() -> None:
@@ -125,6 +129,127 @@ def venv_python(venv_dir: Path) -> Path:
     return venv_dir / "bin" / "python"
 
 
+# ====================================================================
+# Hashing and copying directory trees
+# ====================================================================
+
+
+@functools.cache
+def tree_digest(path: Path, exclude: str | None = None) -> str:
+    """Return a hex digest of the relative paths and contents of all files in a directory tree.
+
+    If given, `exclude` is a subdirectory (e.g. "@tests/test_cases") whose files are left out.
+    The result is cached, so this should only be used for trees that don't change during a test run.
+    """
+    excluded = None if exclude is None else path / exclude
+    digest = hashlib.sha256()
+    for file in sorted(p for p in path.rglob("*") if p.is_file()):
+        if excluded is not None and file.is_relative_to(excluded):
+            continue
+        digest.update(file.relative_to(path).as_posix().encode())
+        digest.update(b"\0")
+        digest.update(file.read_bytes())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def tree_size(path: Path) -> int:
+    """Return the total size of the files in a directory tree, in bytes."""
+    return sum(file.lstat().st_size for file in path.rglob("*") if not file.is_dir())
+
+
+def _link_or_copy(src: str, dst: str) -> None:
+    try:
+        os.link(src, dst)
+    except OSError:  # e.g. different file systems
+        shutil.copy2(src, dst)
+
+
+def hardlink_copytree(src: Path, dst: Path) -> None:
+    """Create a copy of a directory tree whose files are hard links to the original files where possible.
+
+    Only use this if the files are replaced rather than modified in place by whoever uses the copy,
+    otherwise the original files would be modified as well.
+    """
+    shutil.copytree(src, dst, copy_function=_link_or_copy, dirs_exist_ok=True)
+
+
+def link_tree(src: Path, dst: Path) -> None:
+    """Make a directory tree available at another path without copying it, for read-only use.
+
+    `dst` becomes a symlink to `src` where possible. Where symlinks can't be created
+    (e.g. on Windows without developer mode), it's created with `hardlink_copytree` instead.
+    """
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        dst.symlink_to(src.absolute(), target_is_directory=True)
+    except OSError:
+        hardlink_copytree(src, dst)
+
+
+# ====================================================================
+# Locking files shared between processes
+# ====================================================================
+
+
+class FileLock:
+    """An advisory lock on a file, for coordinating concurrent test runs that share a cache.
+
+    Every acquisition opens the lock file anew, so the lock also works between threads of the same process.
+    Shared locks are only supported on POSIX systems; on Windows, they are exclusive.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._fd: int | None = None
+
+    def acquire(self, *, shared: bool = False, blocking: bool = True) -> bool:
+        """Acquire the lock, and return whether it was acquired (which is always the case if `blocking` is true)."""
+        assert self._fd is None, f"{self.path} is already locked"
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            if sys.platform == "win32":
+                import msvcrt
+
+                while True:
+                    try:
+                        msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+                        break
+                    except OSError:
+                        if not blocking:
+                            os.close(fd)
+                            return False
+                        time.sleep(0.1)
+            else:
+                import fcntl
+
+                operation = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+                try:
+                    fcntl.flock(fd, operation if blocking else operation | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    os.close(fd)
+                    return False
+        except BaseException:
+            os.close(fd)
+            raise
+        self._fd = fd
+        return True
+
+    def release(self) -> None:
+        assert self._fd is not None, f"{self.path} is not locked"
+        # Closing the file releases the lock
+        os.close(self._fd)
+        self._fd = None
+
+    def __enter__(self) -> FileLock:
+        self.acquire()
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        self.release()
+
+
 # ====================================================================
 # Parsing the requirements file
 # ====================================================================
@@ -0,0 +1,331 @@
+"""A persistent store of virtual environments, shared by the test scripts and by concurrent test runs."""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import platform
+import re
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+from collections.abc import Callable, Iterable, Sequence
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import AbstractContextManager, nullcontext
+from pathlib import Path
+
+from packaging.requirements import Requirement
+from packaging.utils import canonicalize_name
+
+from .paths import CACHE_PATH
+from .utils import FileLock, get_mypy_req, tree_size, venv_python
+
+__all__ = [
+    "MAX_VENV_CACHE_SIZE",
+    "VENV_CACHE_PATH",
+    "UvCache",
+    "VenvCache",
+    "merge_requirement_sets",
+    "resolve_requirements",
+    "venv_key",
+]
+
+VENV_CACHE_PATH = CACHE_PATH / "venvs"
+# Least recently used venvs are removed when the cache grows beyond this size
+MAX_VENV_CACHE_SIZE = 10 * 1024**3
+
+_MARKER = "typeshed-venv.json"
+
+# Serializes uv installs on Windows
+_UV_INSTALL_LOCK_PATH = CACHE_PATH / "uv-install.lock"
+# The directory of the uv cache that holds a directory for each unpacked wheel
+_UV_ARCHIVE_DIR = "archive-v0"
+
+# Summary lines printed by `uv pip install`, e.g. "Prepared 3 packages in 1.02s"
+_UV_SUMMARY_RE = re.compile(r"^(Prepared|Installed) (\d+) packages?\b", re.MULTILINE)
+
+
+def venv_key(requirements: Iterable[str], *, seed: bool = False) -> str:
+    """Return a stable digest of everything that determines the contents of a venv."""
+    key_data = {
+        "requirements": sorted(requirements),
+        "mypy": get_mypy_req(),
+        "seed": seed,
+        "python": sys.version,
+        "executable": os.path.realpath(sys.executable),
+        "platform": sys.platform,
+        "machine": platform.machine(),
+    }
+    return hashlib.sha256(json.dumps(key_data, sort_keys=True).encode()).hexdigest()[:32]
+
+
+class UvCache:
+    """The uv cache used by all venvs set up by a test run, with statistics about the packages installed from it.
+
+    By default, this is uv's own cache (see `uv cache dir`), which uv manages and which is shared
+    with later test runs and other projects. It can be cleaned up with `uv cache prune`.
+    uv locks the cache itself, so installs into different venvs run concurrently,
+    and every wheel is still only downloaded once. On Windows, installs are serialized
+    between threads and processes through a file lock, since concurrent use of a uv cache
+    isn't safe on old Windows versions: https://github.com/astral-sh/uv/issues/2810.
+    """
+
+    def __init__(self, directory: Path | None = None) -> None:
+        """Use the uv cache in `directory`, or uv's default cache if it's None."""
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._initial_archives: set[str] | None = None
+        self.installs = 0
+        self.packages_downloaded = 0
+        self.packages_installed = 0
+
+    def cache_dir(self) -> Path:
+        """Return the directory of the uv cache."""
+        if self.directory is None:
+            proc = subprocess.run(["uv", "cache", "dir"], capture_output=True, text=True, check=True)
+            self.directory = Path(proc.stdout.strip())
+        return self.directory
+
+    def _archives(self) -> set[str]:
+        try:
+            return {entry.name for entry in (self.cache_dir() / _UV_ARCHIVE_DIR).iterdir()}
+        except (OSError, subprocess.CalledProcessError):
+            return set()
+
+    def install(self, venv_dir: Path, requirements: Sequence[str], *, verbose: bool = False) -> subprocess.CompletedProcess[str]:
+        """Run `uv pip install` for the requirements in a venv, raising `CalledProcessError` if it fails.
+
+        The output of uv is captured, and is printed to stderr if `verbose` is true.
+        """
+        env = {**os.environ, "VIRTUAL_ENV": str(venv_dir)}
+        with self._lock:
+            if self._initial_archives is None:
+                self._initial_archives = self._archives()
+        command = ["uv", "pip", "install", "--cache-dir", str(self.cache_dir()), *requirements]
+        lock: AbstractContextManager[object] = FileLock(_UV_INSTALL_LOCK_PATH) if sys.platform == "win32" else nullcontext()
+        with lock:
+            proc = subprocess.run(command, capture_output=True, text=True, env=env, check=False)
+        counts = {kind: int(count) for kind, count in _UV_SUMMARY_RE.findall(proc.stderr)}
+        with self._lock:
+            self.installs += 1
+            self.packages_downloaded += counts.get("Prepared", 0)
+            self.packages_installed += counts.get("Installed", 0)
+        if verbose:
+            print(f"Running {command}\n{proc.stderr}", end="", file=sys.stderr, flush=True)
+        proc.check_returncode()
+        return proc
+
+    @property
+    def cache_hits(self) -> int:
+        """The number of installed packages that didn't need to be downloaded or built."""
+        return max(self.packages_installed - self.packages_downloaded, 0)
+
+    def bytes_added(self) -> int:
+        """Return the unpacked size of the packages added to the cache since the first install of this run."""
+        if self._initial_archives is None:
+            return 0
+        archive_dir = self.cache_dir() / _UV_ARCHIVE_DIR
+        return sum(tree_size(archive_dir / name) for name in self._archives() - self._initial_archives)
+
+    def summary(self) -> str:
+        return (
+            f"uv cache: {self.bytes_added() / 1024**2:.1f} MiB downloaded (unpacked) for {self.packages_downloaded} "
+            f"package{'s' if self.packages_downloaded != 1 else ''}, "
+            f"{self.cache_hits} cache hit{'s' if self.cache_hits != 1 else ''}, "
+            f"{self.installs} install{'s' if self.installs != 1 else ''} (using {self.cache_dir()})"
+        )
+
+
+class VenvCache:
+    """Virtual environments that are kept between test runs, keyed by `venv_key()`.
+
+    A venv is only used once it has been fully set up, as recorded by a marker file inside it.
+    Venvs returned by `get()` are protected by a shared file lock until the cache is closed,
+    so that concurrent test runs never evict or rebuild a venv that is in use.
+    Each venv is only locked once, however often `get()` returns it.
+    Venvs are created while holding an exclusive lock.
+    """
+
+    def __init__(
+        self, directory: Path = VENV_CACHE_PATH, max_size: int = MAX_VENV_CACHE_SIZE, uv_cache: UvCache | None = None
+    ) -> None:
+        self.directory = directory
+        self.max_size = max_size
+        self.uv_cache = UvCache() if uv_cache is None else uv_cache
+        # The file locks on the venvs returned by `get()`, by key
+        self._held_locks: dict[str, FileLock] = {}
+        # Serializes `get()` calls for the same key, by key
+        self._key_locks: defaultdict[str, threading.Lock] = defaultdict(threading.Lock)
+        self._lock = threading.Lock()
+
+    def _lock_path(self, key: str) -> Path:
+        return self.directory / f"{key}.lock"
+
+    def _is_valid(self, venv_dir: Path, key: str) -> bool:
+        try:
+            marker = json.loads((venv_dir / _MARKER).read_text(encoding="UTF-8"))
+        except (OSError, ValueError):
+            return False
+        return marker.get("key") == key and venv_python(venv_dir).exists()
+
+    def get(
+        self,
+        requirements: Iterable[str],
+        *,
+        seed: bool = False,
+        install: Callable[[Path], object] | None = None,
+        verbose: bool = False,
+    ) -> Path:
+        """Return a venv with the requirements installed, creating it first if necessary.
+
+        By default, the requirements are installed with `uv pip install`, using the shared uv cache.
+        `install` can be used to install them differently; it is only called when the venv is created.
+        """
+        requirements = sorted(requirements)
+        key = venv_key(requirements, seed=seed)
+        venv_dir = self.directory / key
+        with self._lock:
+            key_lock = self._key_locks[key]
+        with key_lock:
+            # The venv is already protected by a lock held by this cache. It mustn't be locked again,
+            # since shared locks are exclusive on Windows, so that would wait for this cache forever.
+            if key not in self._held_locks:
+                lock = FileLock(self._lock_path(key))
+                while True:
+                    lock.acquire(shared=True)
+                    if self._is_valid(venv_dir, key):
+                        break
+                    lock.release()
+                    with FileLock(self._lock_path(key)):
+                        if not self._is_valid(venv_dir, key):
+                            self._create(venv_dir, key, requirements, seed=seed, install=install, verbose=verbose)
+                with self._lock:
+                    self._held_locks[key] = lock
+            # Record the time of use for the LRU eviction
+            (venv_dir / _MARKER).touch()
+        return venv_dir
+
+    def _create(
+        self,
+        venv_dir: Path,
+        key: str,
+        requirements: list[str],
+        *,
+        seed: bool,
+        install: Callable[[Path], object] | None,
+        verbose: bool,
+    ) -> None:
+        if venv_dir.exists():
+            shutil.rmtree(venv_dir)
+        uv_command = ["uv", "venv", "--python", sys.executable, str(venv_dir)]
+        if seed:
+            uv_command.append("--seed")
+        if not verbose:
+            uv_command.append("--quiet")
+        subprocess.run(uv_command, check=True)
+        if install is not None:
+            install(venv_dir)
+        elif requirements:
+            self.uv_cache.install(venv_dir, requirements, verbose=verbose)
+        marker = {"key": key, "requirements": requirements, "size": tree_size(venv_dir), "created": time.time()}
+        (venv_dir / _MARKER).write_text(json.dumps(marker, indent=2), encoding="UTF-8")
+        self.evict()
+
+    def evict(self) -> None:
+        """Remove the least recently used venvs until the cache fits into its maximum size.
+
+        Venvs that are in use, or still being created, are never removed.
+        """
+        entries: list[tuple[float, int, Path]] = []
+        for venv_dir in self.directory.iterdir():
+            if not venv_dir.is_dir():
+                continue
+            marker_path = venv_dir / _MARKER
+            try:
+                size = json.loads(marker_path.read_text(encoding="UTF-8"))["size"]
+                last_used = marker_path.stat().st_mtime
+            except (OSError, ValueError, KeyError):
+                # Incomplete venvs are removed first
+                size, last_used = tree_size(venv_dir), 0.0
+            entries.append((last_used, size, venv_dir))
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, venv_dir in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            lock = FileLock(self._lock_path(venv_dir.name))
+            if not lock.acquire(blocking=False):
+                continue
+            try:
+                shutil.rmtree(venv_dir, ignore_errors=True)
+            finally:
+                lock.release()
+            total_size -= size
+
+    def close(self) -> None:
+        """Allow the venvs returned by `get()` to be evicted by other test runs again."""
+        with self._lock:
+            for lock in self._held_locks.values():
+                lock.release()
+            self._held_locks.clear()
+
+    def __enter__(self) -> VenvCache:
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        self.close()
+
+
+def resolve_requirements(requirements: Iterable[str]) -> dict[str, str] | None:
+    """Resolve requirements for the running interpreter with `uv pip compile`, without installing anything.
+
+    Return the version that would be installed for each package, keyed by normalized package name,
+    or None if the requirements can't be resolved.
+    """
+    command = ["uv", "pip", "compile", "-", "--python", sys.executable, "--quiet", "--no-header", "--no-annotate"]
+    proc = subprocess.run(command, input="\n".join(requirements), capture_output=True, text=True, check=False)
+    if proc.returncode != 0:
+        return None
+    pins: dict[str, str] = {}
+    for line in proc.stdout.splitlines():
+        pin = line.partition(";")[0].strip()
+        if not pin or pin.startswith("#") or "==" not in pin:
+            continue
+        name, _, version = pin.partition("==")
+        pins[canonicalize_name(name.partition("[")[0])] = version.strip()
+    return pins
+
+
+def merge_requirement_sets(
+    requirement_sets: Iterable[frozenset[Requirement]], *, base: Iterable[str] = ()
+) -> dict[frozenset[Requirement], frozenset[Requirement]]:
+    """Plan shared venvs for requirement sets, mapping each set to the set to install for it.
+
+    Sets are only merged if they resolve to exactly the same packages, at the same versions.
+    A venv that had any more packages would let a distribution import packages it doesn't declare,
+    hiding missing dependencies. Sets that can't be resolved get venvs of their own.
+    `base` holds requirements that are installed into every venv, such as mypy.
+    """
+    base = list(base)
+    requirement_sets = sorted(set(requirement_sets), key=lambda reqs: sorted(map(str, reqs)))
+
+    def resolve(requirements: Iterable[Requirement]) -> dict[str, str] | None:
+        return resolve_requirements([*base, *sorted(map(str, requirements))])
+
+    # Limit workers to 10 at a time, since this makes network requests
+    with ThreadPoolExecutor(max_workers=10) as executor:
+        resolutions = dict(zip(requirement_sets, executor.map(resolve, requirement_sets), strict=True))
+
+    plan = {reqs: reqs for reqs in requirement_sets}
+    groups: dict[tuple[tuple[str, str], ...], list[frozenset[Requirement]]] = {}
+    for reqs in requirement_sets:
+        pins = resolutions[reqs]
+        if pins is not None:
+            groups.setdefault(tuple(sorted(pins.items())), []).append(reqs)
+    for members in groups.values():
+        # Any member installs the same packages, so the first one is installed for all of them
+        plan.update(dict.fromkeys(members, members[0]))
+    return plan
@@ -36,6 +36,7 @@ import tomlkit
 from packaging.specifiers import Specifier
 from termcolor import colored
 
+from ts_utils.manifest import get_manifest
 from ts_utils.metadata import ObsoleteMetadata, StubMetadata, read_metadata, update_metadata
 from ts_utils.paths import PYRIGHT_CONFIG, STUBS_PATH, distribution_path
 
@@ -534,7 +535,7 @@ async def analyze_github_diff(
     # https://docs.github.com/en/rest/commits/commits#compare-two-commits
     py_files: list[FileInfo] = [file for file in json_resp["files"] if Path(file["filename"]).suffix == ".py"]
     stub_path = distribution_path(distribution)
-    files_in_typeshed = set(stub_path.rglob("*.pyi"))
+    files_in_typeshed = {file.path for file in get_manifest().distribution_files(distribution)}
     py_files_stubbed_in_typeshed = [file for file in py_files if (stub_path / f"{file['filename']}i") in files_in_typeshed]
     return DiffAnalysis(py_files=py_files, py_files_stubbed_in_typeshed=py_files_stubbed_in_typeshed)
 
@@ -570,7 +571,7 @@ async def analyze_gitlab_diff(
         py_files.append(FileInfo(filename=filename, status=status, additions=additions, deletions=deletions))
 
     stub_path = distribution_path(distribution)
-    files_in_typeshed = set(stub_path.rglob("*.pyi"))
+    files_in_typeshed = {file.path for file in get_manifest().distribution_files(distribution)}
     py_files_stubbed_in_typeshed = [file for file in py_files if (stub_path / f"{file['filename']}i") in files_in_typeshed]
     return DiffAnalysis(py_files=py_files, py_files_stubbed_in_typeshed=py_files_stubbed_in_typeshed)
 
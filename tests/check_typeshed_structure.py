@@ -12,16 +12,11 @@ import os
 import re
 from pathlib import Path
 
+from ts_utils.manifest import get_manifest
 from ts_utils.metadata import read_metadata
 from ts_utils.paths import PYRIGHT_CONFIG, REQUIREMENTS_PATH, STDLIB_PATH, STUBS_PATH, TEST_CASES_DIR, TESTS_DIR, tests_path
-from ts_utils.utils import (
-    get_all_testcase_directories,
-    get_gitignore_spec,
-    jsonc_to_json,
-    parse_requirements,
-    parse_stdlib_versions_file,
-    spec_matches_path,
-)
+from ts_utils.stdlib_versions import get_stdlib_versions_index
+from ts_utils.utils import get_all_testcase_directories, get_gitignore_spec, jsonc_to_json, parse_requirements, spec_matches_path
 
 extension_descriptions = {".pyi": "stub", ".py": ".py"}
 
@@ -98,7 +93,7 @@ def check_distutils() -> None:
     """Check whether all setuptools._distutils files are re-exported from distutils."""
 
     def all_relative_paths_in_directory(path: Path) -> set[Path]:
-        return {pyi.relative_to(path) for pyi in path.rglob("*.pyi")}
+        return {file.path.relative_to(path) for file in get_manifest().files_in(path)}
 
     setuptools_path = STUBS_PATH / "setuptools" / "setuptools" / "_distutils"
     distutils_path = STUBS_PATH / "setuptools" / "distutils"
@@ -130,7 +125,7 @@ def check_no_symlinks() -> None:
 
 def check_versions_file() -> None:
     """Check that the stdlib/VERSIONS file has the correct format."""
-    version_map = parse_stdlib_versions_file()
+    version_map = get_stdlib_versions_index().module_versions
     versions = list(version_map.keys())
 
     sorted_versions = sorted(versions)
@@ -145,16 +140,7 @@ def check_versions_file() -> None:
 
 
 def _find_stdlib_modules() -> set[str]:
-    modules = set[str]()
-    for path, _, files in os.walk(STDLIB_PATH):
-        for filename in files:
-            base_module = ".".join(Path(path).parts[1:])
-            if filename == "__init__.pyi":
-                modules.add(base_module)
-            elif filename.endswith(".pyi"):
-                mod = filename[:-4]
-                modules.add(f"{base_module}.{mod}" if base_module else mod)
-    return modules
+    return {file.module for file in get_manifest().stdlib_files()}
 
 
 def check_metadata() -> None:
@@ -0,0 +1,24 @@
+#!/usr/bin/env python3
+"""Merge the timings files written by the shards of a CI job into the timings file they all started from."""
+
+from __future__ import annotations
+
+import argparse
+from pathlib import Path
+
+from ts_utils.timings import TIMINGS_PATH, merge_timings_files
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("files", type=Path, nargs="*", help="The timings files written by the shards")
+    parser.add_argument(
+        "--base", type=Path, default=TIMINGS_PATH, help=f"The timings file the shards started from (default: {TIMINGS_PATH})"
+    )
+    parser.add_argument("--output", type=Path, help="Where to write the merged timings (default: the base file)")
+    args = parser.parse_args()
+    merge_timings_files(args.base, args.files, args.base if args.output is None else args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,37 +5,62 @@ from __future__ import annotations
 
 import argparse
 import concurrent.futures
+import hashlib
+import importlib
+import io
+import json
 import os
 import subprocess
 import sys
 import tempfile
 import time
 from collections import defaultdict
+from collections.abc import Generator, Iterable
+from contextlib import AbstractContextManager, ExitStack, nullcontext
 from dataclasses import dataclass
 from enum import Enum
+from functools import partial
 from itertools import product
 from pathlib import Path
 from threading import Lock
-from typing import Annotated, Any, NamedTuple, TypeAlias
+from typing import Annotated, Any, NamedTuple, TextIO, TypeAlias
 
 from packaging.requirements import Requirement
 
+from ts_utils.changes import ChangedTargets, changed_targets
+from ts_utils.import_graph import partition_modules, stub_imports
+from ts_utils.manifest import get_manifest
+from ts_utils.memory import PEAK_MEMORY_PATH, MemoryBudget, PeakMemory, parse_memory_size
 from ts_utils.metadata import PackageDependencies, get_recursive_requirements, read_metadata
-from ts_utils.mypy import MypyDistConf, mypy_configuration_from_distribution, temporary_mypy_config_file
+from ts_utils.mypy import (
+    STDLIB_CACHE_DIR,
+    MypyDistConf,
+    copy_prewarmed_stdlib_cache,
+    mypy_configuration_from_distribution,
+    run_mypy_in_worker,
+    temporary_mypy_config_file,
+)
 from ts_utils.paths import STDLIB_PATH, STUBS_PATH, TESTS_DIR, TS_BASE_PATH, distribution_path
+from ts_utils.platforms import COLLAPSED_PLATFORM, platform_dependent_stdlib_names, platform_sensitivity
+from ts_utils.profile import PROFILE_PATH, Profile
 from ts_utils.py315 import PY315_INCOMPATIBLE_RUNTIME_DEPENDENCIES
+from ts_utils.report import Report, ResourceUsage, TaskStatus, process_usage, run_measured
+from ts_utils.result_cache import RESULT_CACHE_PATH, ResultCache, distribution_digest, stdlib_digest
+from ts_utils.stdlib_versions import get_stdlib_versions_index
+from ts_utils.timings import TIMINGS_PATH, Timings, longest_first, shard
 from ts_utils.utils import (
     PYTHON_VERSION,
+    TemporaryFileWrapper,
+    VersionTuple,
     colored,
     get_gitignore_spec,
     get_mypy_req,
-    parse_stdlib_versions_file,
     print_error,
     print_success_msg,
     spec_matches_path,
-    supported_versions_for_module,
     venv_python,
 )
+from ts_utils.venvs import VENV_CACHE_PATH, UvCache, VenvCache, merge_requirement_sets
 
 # Fail early if mypy isn't installed
 try:
@@ -48,6 +73,11 @@ SUPPORTED_VERSIONS = ["3.15", "3.14", "3.13", "3.12", "3.11", "3.10"]
 SUPPORTED_PLATFORMS = ("linux", "win32", "darwin")
 DIRECTORIES_TO_TEST = [STDLIB_PATH, STUBS_PATH]
 
+# Daemons exit after being idle for this many seconds
+DAEMON_TIMEOUT = 30 * 60
+# Warn before starting more daemons than this in one run
+MAX_DAEMONS_WITHOUT_WARNING = 8
+
 VersionString: TypeAlias = Annotated[str, "Must be one of the entries in SUPPORTED_VERSIONS"]
 Platform: TypeAlias = Annotated[str, "Must be one of the entries in SUPPORTED_PLATFORMS"]
 
@@ -59,6 +89,25 @@ class CommandLineArgs:
     exclude: list[Path] | None
     python_version: list[VersionString] | None
     platform: list[Platform] | None
+    jobs: int
+    concurrent_matrix: bool
+    in_process: bool
+    daemon: bool
+    stop_daemons: bool
+    shared_stdlib_cache: bool
+    batch_size: int
+    result_cache: bool
+    changed_since: str | None
+    num_shards: int
+    shard_index: int
+    report: Path | None
+    junit_xml: Path | None
+    venv_cache: bool
+    isolated_venvs: bool
+    max_memory: int | None
+    profile: bool
+    stdlib_shards: int
+    collapse_platforms: bool
 
 
 def valid_path(cmd_arg: str) -> Path:
@@ -108,6 +157,147 @@ parser.add_argument(
     action="extend",
     help="Run mypy for certain OS platforms (defaults to sys.platform only)",
 )
+parser.add_argument(
+    "-j",
+    "--jobs",
+    type=int,
+    default=1,
+    help="Number of third-party distributions to check concurrently (defaults to 1; use 0 for the number of available CPUs)",
+)
+parser.add_argument(
+    "--concurrent-matrix",
+    action="store_true",
+    help=(
+        "Check all combinations of --python-version and --platform at the same time, "
+        "scheduling all mypy runs into one pool of --jobs workers"
+    ),
+)
+engine_group = parser.add_mutually_exclusive_group()
+engine_group.add_argument(
+    "--in-process",
+    action="store_true",
+    help=(
+        "Run mypy via mypy.api in a pool of long-lived worker processes that have mypy imported already, "
+        "instead of starting a new mypy process for every run. "
+        "Distributions that need a venv are still checked using the venv's interpreter"
+    ),
+)
+engine_group.add_argument(
+    "--daemon",
+    action="store_true",
+    help=(
+        "Check the stubs with mypy daemons that are kept running between invocations of this script, "
+        "so that repeated runs only recheck the files that have changed. "
+        "One daemon is started for each distinct mypy configuration (i.e. for each distribution, Python version and platform), "
+        f"so explicit paths to test are required. Daemons exit after being idle for {DAEMON_TIMEOUT // 60} minutes; "
+        "use --stop-daemons to stop them earlier"
+    ),
+)
+parser.add_argument(
+    "--shared-stdlib-cache",
+    action="store_true",
+    help=(
+        "Analyse the stdlib once for each Python version and platform, and start every third-party run "
+        f"from a hard-linked copy of the resulting mypy cache (stored in {STDLIB_CACHE_DIR})"
+    ),
+)
+parser.add_argument(
+    "--batch-size",
+    type=int,
+    default=1,
+    help=(
+        "Check up to this many third-party distributions in a single mypy run, "
+        "if they have no non-types dependencies and no [mypy-tests] settings (defaults to 1, i.e. no batching)"
+    ),
+)
+parser.add_argument(
+    "--result-cache",
+    action="store_true",
+    help=(
+        "Skip distributions whose stubs, typeshed dependencies and test settings haven't changed "
+        f"since they last passed, and remember the ones that pass (stored in {RESULT_CACHE_PATH})"
+    ),
+)
+parser.add_argument(
+    "--num-shards",
+    type=int,
+    default=1,
+    help=(
+        "Split the stdlib and the third-party distributions into shards of similar total runtime, "
+        f"based on the durations in {TIMINGS_PATH}, and only test one of them"
+    ),
+)
+parser.add_argument("--shard-index", type=int, default=0, help="The shard to test when using --num-shards")
+parser.add_argument(
+    "--stdlib-shards",
+    type=int,
+    default=1,
+    metavar="N",
+    help=(
+        "Split the stdlib into N groups of modules, keeping import cycles together, and check them in parallel mypy runs. "
+        "With --num-shards, the groups are distributed between the shards like third-party distributions"
+    ),
+)
+parser.add_argument(
+    "--report",
+    type=Path,
+    metavar="PATH",
+    help=(
+        "Write a JSON report with the outcome, duration and resource usage of every task to this file "
+        "(resource usage is only measured for mypy subprocesses, not with --in-process or --daemon)"
+    ),
+)
+parser.add_argument("--junit-xml", type=Path, metavar="PATH", help="Write a JUnit XML report to this file")
+parser.add_argument(
+    "--venv-cache",
+    action="store_true",
+    help=f"Keep the venvs for stubs with non-types dependencies in {VENV_CACHE_PATH}, and reuse them in later runs",
+)
+parser.add_argument(
+    "--max-memory",
+    type=parse_memory_size,
+    metavar="SIZE",
+    help=(
+        "Only start a mypy run if the expected peak memory usage of all running mypy runs stays below SIZE (e.g. 8G), "
+        f"based on the usage recorded by earlier runs in {PEAK_MEMORY_PATH}"
+    ),
+)
+parser.add_argument(
+    "--isolated-venvs",
+    action="store_true",
+    help=(
+        "Set up a separate venv for each set of non-types dependencies, "
+        "instead of sharing venvs between stubs whose dependencies resolve to exactly the same packages"
+    ),
+)
+parser.add_argument(
+    "--profile",
+    action="store_true",
+    help=(
+        "Run mypy with --timing-stats and --line-checking-stats, and print the stub modules and lines "
+        f"that took mypy the most time to check for each Python version and platform (all totals are written to {PROFILE_PATH}). "
+        "Can't be combined with --daemon, --shared-stdlib-cache or --result-cache, which skip checking modules"
+    ),
+)
+parser.add_argument(
+    "--collapse-platforms",
+    action="store_true",
+    help=(
+        f"Only test the distributions whose stubs can't give different results on different platforms on {COLLAPSED_PLATFORM}, "
+        "and skip them for other platforms. Use -v to see why each distribution is or isn't skipped"
+    ),
+)
+parser.add_argument(
+    "--changed-since",
+    metavar="REV",
+    help=(
+        "Only test the distributions changed since the merge base of this git revision, "
+        "and the distributions that depend on them. Changes to the stdlib select everything"
+    ),
+)
+engine_group.add_argument(
+    "--stop-daemons", action="store_true", help="Stop all mypy daemons that were started with --daemon, then exit"
+)
 
 
 @dataclass
@@ -119,6 +309,30 @@ class TestConfig:
     exclude: list[Path]
     version: VersionString
     platform: Platform
+    # Pool of long-lived worker processes for --in-process runs
+    mypy_workers: concurrent.futures.Executor | None = None
+    daemon: bool = False
+    shared_stdlib_cache: bool = False
+    batch_size: int = 1
+    result_cache: ResultCache | None = None
+    changed: ChangedTargets | None = None
+    # The stdlib and third-party distributions in the shard being tested, or None if not sharding
+    shard: frozenset[str] | None = None
+    timings: Timings | None = None
+    report: Report | None = None
+    venv_cache: VenvCache | None = None
+    merge_venvs: bool = True
+    uv_cache: UvCache | None = None
+    # Thread pool for setting up venvs in the background, while other distributions are being tested
+    venv_workers: concurrent.futures.Executor | None = None
+    # The number of third-party tasks to run at the same time, with an executor
+    jobs: int = 1
+    memory_budget: MemoryBudget | None = None
+    profile: Profile | None = None
+    # The number of parallel mypy runs that the stdlib is split into
+    stdlib_shards: int = 1
+    # Only test distributions whose results can't depend on the platform on COLLAPSED_PLATFORM
+    collapse_platforms: bool = False
 
 
 def log(args: TestConfig, *varargs: object) -> None:
@@ -148,15 +362,27 @@ def match(path: Path, args: TestConfig) -> bool:
     return False
 
 
+def match_all(directory: Path, args: TestConfig) -> bool:
+    """Return whether all files in a directory match, so that they don't need to be matched one by one."""
+    for excluded_path in args.exclude:
+        if directory == excluded_path or excluded_path in directory.parents or directory in excluded_path.parents:
+            return False
+    for included_path in args.filter:
+        if directory == included_path or included_path in directory.parents:
+            log(args, directory, "and everything in it is included")
+            return True
+    return False
+
+
 def add_files(files: list[Path], module: Path, args: TestConfig) -> None:
     """Add all files in package or module represented by 'name' located in 'root'."""
     if module.name.startswith("."):
         return
-    if module.is_file() and module.suffix == ".pyi":
-        if match(module, args):
-            files.append(module)
+    stub_files = [file.path for file in get_manifest().files_in(module)]
+    if match_all(module, args):
+        files.extend(sorted(stub_files))
     else:
-        files.extend(sorted(file for file in module.rglob("*.pyi") if match(file, args)))
+        files.extend(sorted(file for file in stub_files if match(file, args)))
 
 
 class MypyResult(Enum):
@@ -174,7 +400,114 @@ class MypyResult(Enum):
             return MypyResult.CRASH
 
 
-def run_mypy(
+REPORT_STATUSES: dict[MypyResult, TaskStatus] = {
+    MypyResult.SUCCESS: "success",
+    MypyResult.FAILURE: "failure",
+    MypyResult.CRASH: "crash",
+}
+
+
+def init_mypy_worker() -> None:
+    """Import mypy's main modules once, when a worker process starts."""
+    importlib.import_module("mypy.api")
+    importlib.import_module("mypy.build")
+
+
+DAEMON_DIR = TS_BASE_PATH / ".mypy_cache" / "dmypy"
+STDLIB_SHARDS_CACHE_DIR = TS_BASE_PATH / ".mypy_cache" / "stdlib-shards"
+
+
+def daemon_command(
+    python_path: str, flags: list[str], files: list[Path], mypypath: str | None, config_file: TemporaryFileWrapper[str]
+) -> list[str]:
+    """Return a `dmypy run` command for a mypy run with the given settings.
+
+    The daemon is identified by a status file whose name is derived from all of the settings,
+    so every distinct configuration gets its own daemon, which is reused by later runs.
+    `dmypy run` starts the daemon if it isn't running yet;
+    otherwise, the daemon only rechecks the files that have changed since the last run.
+    """
+    config_file.seek(0)
+    config = config_file.read()
+    flags = flags.copy()
+    config_index = flags.index("--config-file") + 1
+    flags[config_index] = "<config>"
+    key_data = json.dumps([python_path, flags, mypypath, config])
+    key = hashlib.sha256(key_data.encode()).hexdigest()[:16]
+
+    DAEMON_DIR.mkdir(parents=True, exist_ok=True)
+    # The daemon would restart if the path of its config file changed,
+    # so use a persistent copy of the temporary config file
+    daemon_config = DAEMON_DIR / f"{key}.ini"
+    if not daemon_config.exists() or daemon_config.read_text(encoding="UTF-8") != config:
+        daemon_config.write_text(config, encoding="UTF-8")
+    flags[config_index] = str(daemon_config)
+    flags.extend(["--cache-dir", str(DAEMON_DIR / key)])
+
+    status_file = DAEMON_DIR / f"{key}.json"
+    return [
+        python_path,
+        "-m",
+        "mypy.dmypy",
+        "--status-file",
+        str(status_file),
+        "run",
+        "--timeout",
+        str(DAEMON_TIMEOUT),
+        "--",
+        *flags,
+        *map(str, files),
+    ]
+
+
+def daemon_targets(path_filter: list[Path]) -> set[str]:
+    """Return the stdlib and third-party distributions that a mypy run with --daemon starts a daemon for."""
+    targets: set[str] = set()
+    for path in path_filter:
+        if path == STDLIB_PATH or STDLIB_PATH in path.parents:
+            targets.add("stdlib")
+        elif path == STUBS_PATH:
+            targets.update(os.listdir(STUBS_PATH))
+        elif STUBS_PATH in path.parents:
+            targets.add(path.relative_to(STUBS_PATH).parts[0])
+    return targets
+
+
+def stop_daemons() -> int:
+    """Stop all mypy daemons started with --daemon, and return the number of daemons that were stopped."""
+    stopped = 0
+    for status_file in sorted(DAEMON_DIR.glob("*.json")):
+        dmypy_command = [sys.executable, "-m", "mypy.dmypy", "--status-file", str(status_file)]
+        result = subprocess.run([*dmypy_command, "stop"], capture_output=True, text=True, check=False)
+        if result.returncode:
+            # The daemon might not be responding anymore
+            result = subprocess.run([*dmypy_command, "kill"], capture_output=True, text=True, check=False)
+        if result.returncode == 0:
+            stopped += 1
+        status_file.unlink(missing_ok=True)
+        status_file.with_suffix(".ini").unlink(missing_ok=True)
+    return stopped
+
+
+def use_prewarmed_stdlib_cache(args: TestConfig, flags: list[str], cache_dir: Path, output: TextIO | None = None) -> bool:
+    """Copy a mypy cache in which all stdlib modules have already been analysed into `cache_dir`.
+
+    Return whether the cache could be built. See `ts_utils.mypy.copy_prewarmed_stdlib_cache`.
+    """
+
+    def log_build(msg: str) -> None:
+        if args.verbose:
+            print(colored(f"\n{msg}", "blue"), file=output)
+
+    try:
+        copy_prewarmed_stdlib_cache(flags, args.version, cache_dir, log=log_build)
+    except RuntimeError as e:
+        print_error(f"\n{e}", file=output)
+        return False
+    return True
+
+
+def execute_mypy(
     args: TestConfig,
     configurations: list[MypyDistConf],
     files: list[Path],
@@ -183,11 +516,13 @@ def run_mypy(
     non_types_dependencies: bool,
     venv_dir: Path | None,
     mypypath: str | None = None,
-) -> MypyResult:
+    cache_dir: Path | None = None,
+    output: TextIO | None = None,
+) -> subprocess.CompletedProcess[str]:
     env_vars = dict(os.environ)
     if mypypath is not None:
         env_vars["MYPYPATH"] = mypypath
-    with temporary_mypy_config_file(configurations) as temp:
+    with temporary_mypy_config_file(configurations) as temp, ExitStack() as stack:
         flags = [
             "--python-version",
             args.version,
@@ -216,27 +551,93 @@ def run_mypy(
             flags.append("--explicit-package-bases")
         if not non_types_dependencies:
             flags.append("--no-site-packages")
+        stats_dir = None
+        if args.profile is not None:
+            stats_dir = Path(stack.enter_context(tempfile.TemporaryDirectory()))
+            flags.extend(Profile.mypy_flags(stats_dir))
 
-        mypy_args = [*flags, *map(str, files)]
         python_path = sys.executable if venv_dir is None else str(venv_python(venv_dir))
-        mypy_command = [python_path, "-m", "mypy", *mypy_args]
+        if args.daemon:
+            # Daemons use persistent cache directories of their own
+            mypy_args = []
+            mypy_command = daemon_command(python_path, flags, files, mypypath, temp)
+        else:
+            if cache_dir is not None:
+                if args.shared_stdlib_cache and not testing_stdlib and use_prewarmed_stdlib_cache(args, flags, cache_dir, output):
+                    flags.append("--no-sqlite-cache")
+                flags.extend(["--cache-dir", str(cache_dir)])
+            mypy_args = [*flags, *map(str, files)]
+            mypy_command = [python_path, "-m", "mypy", *mypy_args]
+        in_process = venv_dir is None and args.mypy_workers is not None
         if args.verbose:
-            print(colored(f"running {' '.join(mypy_command)}", "blue"))
-        result = subprocess.run(mypy_command, capture_output=True, text=True, env=env_vars, check=False)
+            description = " (in-process)" if in_process else ""
+            print(colored(f"running {' '.join(mypy_command)}{description}", "blue"), file=output)
+        if in_process:
+            assert args.mypy_workers is not None
+            stdout, stderr, returncode = args.mypy_workers.submit(run_mypy_in_worker, mypy_args, mypypath).result()
+            result = subprocess.CompletedProcess(mypy_command, returncode, stdout, stderr)
+        elif args.daemon:
+            result = subprocess.run(mypy_command, capture_output=True, text=True, env=env_vars, check=False)
+        else:
+            result = run_measured(mypy_command, env=env_vars)
+        if args.profile is not None and stats_dir is not None:
+            args.profile.add_run(args.version, args.platform, stats_dir)
+    return result
+
+
+def run_mypy(
+    args: TestConfig,
+    configurations: list[MypyDistConf],
+    files: list[Path],
+    *,
+    testing_stdlib: bool,
+    non_types_dependencies: bool,
+    venv_dir: Path | None,
+    mypypath: str | None = None,
+    cache_dir: Path | None = None,
+    output: TextIO | None = None,
+) -> tuple[MypyResult, subprocess.CompletedProcess[str]]:
+    result = execute_mypy(
+        args,
+        configurations,
+        files,
+        testing_stdlib=testing_stdlib,
+        non_types_dependencies=non_types_dependencies,
+        venv_dir=venv_dir,
+        mypypath=mypypath,
+        cache_dir=cache_dir,
+        output=output,
+    )
+    print_mypy_result(args, result, non_types_dependencies=non_types_dependencies, venv_dir=venv_dir, output=output)
+    return MypyResult.from_process_result(result), result
+
+
+def print_mypy_result(
+    args: TestConfig,
+    result: subprocess.CompletedProcess[str],
+    *,
+    non_types_dependencies: bool,
+    venv_dir: Path | None,
+    output: TextIO | None = None,
+) -> None:
     if result.returncode:
-        print_error(f"failure (exit code {result.returncode})\n")
+        print_error(f"failure (exit code {result.returncode})\n", file=output)
         if result.stdout:
-            print_error(result.stdout)
+            print_error(result.stdout, file=output)
         if result.stderr:
-            print_error(result.stderr)
+            print_error(result.stderr, file=output)
         if non_types_dependencies and args.verbose:
-            print("Ran with the following environment:")
-            subprocess.run(["uv", "pip", "freeze"], env={**os.environ, "VIRTUAL_ENV": str(venv_dir)}, check=False)
-            print()
+            print("Ran with the following environment:", file=output)
+            freeze = subprocess.run(
+                ["uv", "pip", "freeze"],
+                env={**os.environ, "VIRTUAL_ENV": str(venv_dir)},
+                capture_output=True,
+                text=True,
+                check=False,
+            )
+            print(freeze.stdout, file=output)
     else:
-        print_success_msg()
-
-    return MypyResult.from_process_result(result)
+        print_success_msg(file=output)
 
 
 def add_third_party_files(distribution: str, files: list[Path], args: TestConfig, seen_dists: set[str]) -> None:
@@ -255,8 +656,85 @@ class TestResult(NamedTuple):
     files_checked: int
 
 
+def result_cache_key(args: TestConfig, digest: str, files: list[Path]) -> str | None:
+    """Return the result-cache key for a mypy run, or `None` if --result-cache isn't in use."""
+    if args.result_cache is None:
+        return None
+    return args.result_cache.key(digest, stdlib_digest(), args.version, args.platform, [file.as_posix() for file in files])
+
+
+def has_cached_success(args: TestConfig, cache_key: str | None) -> bool:
+    return cache_key is not None and args.result_cache is not None and args.result_cache.is_success(cache_key)
+
+
+def record_success(args: TestConfig, cache_key: str | None, **details: object) -> None:
+    if cache_key is not None and args.result_cache is not None:
+        args.result_cache.record_success(cache_key, **details)
+
+
+def record_task(
+    args: TestConfig,
+    task: str,
+    result: MypyResult,
+    files_checked: int,
+    *,
+    start: float | None = None,
+    process: subprocess.CompletedProcess[str] | None = None,
+    share: float = 1.0,
+    output: str | None = None,
+) -> None:
+    """Record the outcome, duration and peak memory usage of a task in the timings files and in the report.
+
+    `start` is None if the result came from the result cache.
+    If the task was checked in a single mypy run together with others,
+    `share` is the part of the time and CPU time of the run that is attributed to it.
+    """
+    wall_time = None
+    if start is not None:
+        wall_time = (time.perf_counter() - start) * share
+        if args.timings is not None:
+            args.timings.record(task, wall_time)
+    usage = None if process is None else process_usage(process)
+    # The peak memory usage of a batch is that of each of its distributions
+    if usage is not None and args.memory_budget is not None:
+        args.memory_budget.peak_memory.record(task, usage.peak_rss)
+    if args.report is None:
+        return
+    if usage is not None and share != 1.0:
+        usage = ResourceUsage(cpu_time=usage.cpu_time * share, peak_rss=usage.peak_rss)
+    if output is None and process is not None:
+        output = process.stdout + process.stderr
+    args.report.add(
+        task,
+        args.version,
+        args.platform,
+        REPORT_STATUSES[result],
+        exit_code=result.value,
+        files=files_checked,
+        wall_time=wall_time,
+        usage=usage,
+        cached=start is None,
+        output=output,
+    )
+
+
+def report_skipped(args: TestConfig, task: str, reason: str) -> None:
+    if args.report is not None:
+        args.report.add(task, args.version, args.platform, "skipped", output=reason)
+
+
+def print_cached_success(output: TextIO | None = None) -> None:
+    print(colored("success (cached)", "green"), file=output)
+
+
 def test_third_party_distribution(
-    distribution: str, args: TestConfig, venv_dir: Path | None, *, non_types_dependencies: bool
+    distribution: str,
+    args: TestConfig,
+    venv_dir: Path | None,
+    *,
+    non_types_dependencies: bool,
+    cache_dir: Path | None = None,
+    output: TextIO | None = None,
 ) -> TestResult:
     """Test the stubs of a third-party distribution.
 
@@ -271,16 +749,23 @@ def test_third_party_distribution(
     if not files and args.filter:
         return TestResult(MypyResult.SUCCESS, 0)
 
-    print(f"testing {distribution} ({len(files)} files)... ", end="", flush=True)
+    print(f"testing {distribution} ({len(files)} files)... ", end="", flush=True, file=output)
 
     if not files:
-        print_error("no files found")
+        print_error("no files found", file=output)
         sys.exit(1)
 
+    cache_key = result_cache_key(args, distribution_digest(distribution), files)
+    if has_cached_success(args, cache_key):
+        print_cached_success(output)
+        record_task(args, distribution, MypyResult.SUCCESS, len(files))
+        return TestResult(MypyResult.SUCCESS, len(files))
+
     mypypath = os.pathsep.join(str(distribution_path(dist)) for dist in seen_dists)
     if args.verbose:
-        print(colored(f"\nMYPYPATH={mypypath}", "blue"))
-    result = run_mypy(
+        print(colored(f"\nMYPYPATH={mypypath}", "blue"), file=output)
+    start = time.perf_counter()
+    result, process = run_mypy(
         args,
         configurations,
         files,
@@ -288,11 +773,299 @@ def test_third_party_distribution(
         mypypath=mypypath,
         testing_stdlib=False,
         non_types_dependencies=non_types_dependencies,
+        cache_dir=cache_dir,
+        output=output,
     )
+    record_task(args, distribution, result, len(files), start=start, process=process)
+    if result == MypyResult.SUCCESS:
+        record_success(args, cache_key, distribution=distribution, files=len(files))
     return TestResult(result, len(files))
 
 
-def test_stdlib(args: TestConfig) -> TestResult:
+def provided_modules(distribution: str) -> set[str]:
+    """Return the names of the top-level modules and packages in the stubs of a distribution."""
+    return {
+        path.name.removesuffix(".pyi")
+        for path in distribution_path(distribution).iterdir()
+        if path.suffix == ".pyi" or (path.is_dir() and path.name.isidentifier())
+    }
+
+
+def imported_modules(distribution: str) -> set[str]:
+    """Return the names of the top-level modules and packages that the stubs of a distribution import."""
+    return {
+        imported.partition(".")[0]
+        for file in get_manifest().distribution_files(distribution)
+        for imported in stub_imports(file.module, file.path)
+    }
+
+
+def batch_distributions(distributions: Iterable[str], batch_size: int) -> list[list[str]]:
+    """Group distributions into batches that can be checked in a single mypy run.
+
+    The distributions in a batch, and their typeshed dependencies,
+    never provide a top-level module with the same name,
+    so that all of them can be put on the MYPYPATH at the same time.
+    They also never import a top-level module that another distribution in the batch provides
+    outside of their own typeshed dependencies: on the shared MYPYPATH, such an import would be found,
+    instead of being reported as an undeclared dependency.
+    Distributions whose imports can't be determined, because of a syntax error, get batches of their own.
+    """
+    batches: list[tuple[list[str], dict[str, str], set[str]]] = []
+    unbatched: list[list[str]] = []
+    for distribution in distributions:
+        closure = {distribution, *(r.name for r in get_recursive_requirements(distribution).typeshed_pkgs)}
+        modules = {module: dist for dist in closure for module in provided_modules(dist)}
+        try:
+            # The modules that the distribution and its dependencies import, but don't provide themselves
+            foreign_imports = {module for dist in closure for module in imported_modules(dist)} - modules.keys()
+        except SyntaxError:
+            # Left for mypy to report
+            unbatched.append([distribution])
+            continue
+        for batch, batch_modules, batch_foreign_imports in batches:
+            if (
+                len(batch) < batch_size
+                and all(batch_modules.get(module, dist) == dist for module, dist in modules.items())
+                and foreign_imports.isdisjoint(batch_modules)
+                and batch_foreign_imports.isdisjoint(modules)
+            ):
+                batch.append(distribution)
+                batch_modules.update(modules)
+                batch_foreign_imports.update(foreign_imports)
+                break
+        else:
+            batches.append(([distribution], modules, foreign_imports))
+    return [*(batch for batch, _, _ in batches), *unbatched]
+
+
+def owning_distribution(mypy_output_line: str) -> str | None:
+    """Return the distribution containing the file that a line of mypy output refers to."""
+    path = Path(mypy_output_line.split(":", 1)[0])
+    if STUBS_PATH not in path.parents:
+        return None
+    return path.relative_to(STUBS_PATH).parts[0]
+
+
+def test_third_party_batch(
+    distributions: list[str], args: TestConfig, *, cache_dir: Path | None = None, output: TextIO | None = None
+) -> list[TestResult] | None:
+    """Test the stubs of several third-party distributions in a single mypy run.
+
+    The distributions must not need a venv or any [mypy-tests] settings.
+    mypy's errors are attributed to the distributions using the paths in the error messages.
+
+    Return `None` if the batch must be split up, because mypy crashed
+    or not all of its output could be attributed to a distribution in the batch.
+    """
+    files_by_distribution: dict[str, list[Path]] = {}
+    cache_keys: dict[str, str | None] = {}
+    cached_distributions: dict[str, int] = {}
+    mypypath_dists: set[str] = set()
+    for distribution in distributions:
+        files: list[Path] = []
+        seen_dists: set[str] = set()
+        add_third_party_files(distribution, files, args, seen_dists)
+        if not files:
+            return None
+        cache_key = result_cache_key(args, distribution_digest(distribution), files)
+        if has_cached_success(args, cache_key):
+            cached_distributions[distribution] = len(files)
+            continue
+        files_by_distribution[distribution] = files
+        cache_keys[distribution] = cache_key
+        mypypath_dists.update(seen_dists)
+
+    def cached_results() -> list[TestResult]:
+        # Only reported once it's certain that the batch won't be split up, which tests them again
+        results: list[TestResult] = []
+        for distribution, files_checked in cached_distributions.items():
+            print(f"testing {distribution} ({files_checked} files)... ", end="", file=output)
+            print_cached_success(output)
+            record_task(args, distribution, MypyResult.SUCCESS, files_checked)
+            results.append(TestResult(MypyResult.SUCCESS, files_checked))
+        return results
+
+    if not files_by_distribution:
+        return cached_results()
+
+    mypypath = os.pathsep.join(sorted(str(distribution_path(dist)) for dist in mypypath_dists))
+    if args.verbose:
+        print(colored(f"testing batch {', '.join(distributions)}\nMYPYPATH={mypypath}", "blue"), file=output)
+    all_files = [file for files in files_by_distribution.values() for file in files]
+    start = time.perf_counter()
+    result = execute_mypy(
+        args,
+        [],
+        all_files,
+        testing_stdlib=False,
+        non_types_dependencies=False,
+        venv_dir=None,
+        mypypath=mypypath,
+        cache_dir=cache_dir,
+        output=output,
+    )
+    if MypyResult.from_process_result(result) == MypyResult.CRASH or result.stderr:
+        return None
+
+    errors: defaultdict[str, list[str]] = defaultdict(list)
+    for line in result.stdout.splitlines():
+        owner = owning_distribution(line)
+        if owner is None or owner not in files_by_distribution or "Duplicate module named" in line or "found twice" in line:
+            return None
+        errors[owner].append(line)
+    if result.returncode and not errors:
+        return None
+
+    results = cached_results()
+    for distribution, files in files_by_distribution.items():
+        print(f"testing {distribution} ({len(files)} files)... ", end="", file=output)
+        dist_errors = "\n".join(errors[distribution])
+        if dist_errors:
+            print_error("failure (exit code 1)\n", file=output)
+            print_error(dist_errors, file=output)
+            dist_result = MypyResult.FAILURE
+        else:
+            print_success_msg(file=output)
+            dist_result = MypyResult.SUCCESS
+            record_success(args, cache_keys[distribution], distribution=distribution, files=len(files))
+        results.append(TestResult(dist_result, len(files)))
+        record_task(
+            args,
+            distribution,
+            dist_result,
+            len(files),
+            start=start,
+            process=result,
+            share=len(files) / len(all_files),
+            output=dist_errors,
+        )
+    return results
+
+
+def reserve_memory(args: TestConfig, *tasks: str) -> AbstractContextManager[None]:
+    return nullcontext() if args.memory_budget is None else args.memory_budget.reserve(*tasks)
+
+
+def test_third_party_task(
+    distributions: list[str], args: TestConfig, *, cache_root: Path | None = None, output: TextIO | None = None
+) -> list[TestResult]:
+    """Test a batch of third-party distributions, or a single distribution.
+
+    If the batch has to be split up, the distributions are tested one by one instead.
+    With a memory budget, the task waits until its expected memory usage fits into the budget.
+    """
+    with reserve_memory(args, *distributions):
+        if len(distributions) > 1:
+            batch_cache_dir = None if cache_root is None else cache_root / f"batch-{distributions[0]}"
+            batch_results = test_third_party_batch(distributions, args, cache_dir=batch_cache_dir, output=output)
+            if batch_results is not None:
+                return batch_results
+            if args.verbose:
+                print(colored(f"splitting up batch {', '.join(distributions)}", "blue"), file=output)
+
+        results: list[TestResult] = []
+        for distribution in distributions:
+            venv_dir = _DISTRIBUTION_TO_VENV_MAPPING[distribution].result()
+            result = test_third_party_distribution(
+                distribution,
+                args,
+                venv_dir,
+                non_types_dependencies=venv_dir is not None,
+                cache_dir=None if cache_root is None else cache_root / distribution,
+                output=output,
+            )
+            results.append(result)
+        return results
+
+
+def stdlib_targets(num_shards: int) -> list[str]:
+    """Return the task names of the stdlib, which is split into `num_shards` separate mypy runs."""
+    if num_shards == 1:
+        return ["stdlib"]
+    return [f"stdlib-shard-{index}-of-{num_shards}" for index in range(num_shards)]
+
+
+def stdlib_shards(args: TestConfig, files: list[Path]) -> dict[str, list[Path]]:
+    """Split the stdlib files along import cycles, returning the non-empty shards that should be tested by this run."""
+    if args.stdlib_shards == 1:
+        return {"stdlib": files}
+    file_set = set(files)
+    modules = {file.module: file.path for file in get_manifest().stdlib_files() if file.path in file_set}
+    try:
+        groups = partition_modules(modules, args.stdlib_shards)
+    except SyntaxError:
+        # Without an import graph, the stdlib is tested in a single run, which reports the syntax error.
+        # With --num-shards, it's tested by the shard that the first part of the stdlib belongs to.
+        if args.shard is not None and stdlib_targets(args.stdlib_shards)[0] not in args.shard:
+            return {}
+        return {"stdlib": files}
+    return {
+        task: group
+        for task, group in zip(stdlib_targets(args.stdlib_shards), groups, strict=True)
+        if group and (args.shard is None or task in args.shard)
+    }
+
+
+def test_stdlib_shard(
+    args: TestConfig, task: str, files: list[Path], output: TextIO | None = None, *, cache_root: Path | None = None
+) -> subprocess.CompletedProcess[str] | None:
+    """Run mypy on some of the stdlib files, returning None if they were already checked successfully.
+
+    `cache_root` is the cache directory of the current Python version and platform,
+    if mypy runs of other configurations can be running at the same time.
+    """
+    cache_key = result_cache_key(args, stdlib_digest(), files)
+    if has_cached_success(args, cache_key):
+        record_task(args, task, MypyResult.SUCCESS, len(files))
+        return None
+    # We don't actually need to install anything for the stdlib testing
+    with reserve_memory(args, task):
+        start = time.perf_counter()
+        process = execute_mypy(
+            args,
+            [],
+            files,
+            venv_dir=None,
+            testing_stdlib=True,
+            non_types_dependencies=False,
+            cache_dir=stdlib_cache_dir(args, task, cache_root),
+            output=output,
+        )
+    result = MypyResult.from_process_result(process)
+    record_task(args, task, result, len(files), start=start, process=process)
+    if result == MypyResult.SUCCESS:
+        record_success(args, cache_key, distribution=task, files=len(files))
+    return process
+
+
+def stdlib_cache_dir(args: TestConfig, task: str, cache_root: Path | None) -> Path | None:
+    """Return the mypy cache directory for a stdlib task, or None to use mypy's default."""
+    if task != "stdlib":
+        # mypy caches whether a module was tested or only imported,
+        # so shards that shared a cache would keep invalidating each other's entries.
+        # Runs for other Python versions and platforms (possibly concurrent ones) get caches of their own.
+        return STDLIB_SHARDS_CACHE_DIR / args.version / args.platform / task
+    if cache_root is not None:
+        # mypy's default cache directory is only split by Python version, not by platform,
+        # so concurrent runs for different platforms would race on it,
+        # see https://github.com/python/mypy/issues/13916
+        return cache_root / "stdlib"
+    return None
+
+
+def merge_processes(processes: list[subprocess.CompletedProcess[str]]) -> subprocess.CompletedProcess[str]:
+    """Combine the results of mypy runs on parts of the same files into the result of a single run.
+
+    The exit code is that of the worst result. Errors that were reported by more than one run are only kept once.
+    """
+    worst = max(processes, key=lambda process: MypyResult.from_process_result(process).value)
+    stdout = dict.fromkeys(line for process in processes for line in process.stdout.splitlines(keepends=True))
+    stderr = "".join(process.stderr for process in processes)
+    return subprocess.CompletedProcess(worst.args, worst.returncode, "".join(stdout), stderr)
+
+
+def test_stdlib(args: TestConfig, output: TextIO | None = None, *, cache_root: Path | None = None) -> TestResult:
     files: list[Path] = []
     for file in STDLIB_PATH.iterdir():
         if file.name in ("VERSIONS", TESTS_DIR):
@@ -300,37 +1073,42 @@ def test_stdlib(args: TestConfig) -> TestResult:
         add_files(files, file, args)
 
     files = remove_modules_not_in_python_version(files, args.version)
+    shards = stdlib_shards(args, files) if files else {}
+    files_checked = sum(map(len, shards.values()))
 
-    if not files:
+    if not files_checked:
         return TestResult(MypyResult.SUCCESS, 0)
 
-    print(f"Testing stdlib ({len(files)} files)... ", end="", flush=True)
-    # We don't actually need to install anything for the stdlib testing
-    result = run_mypy(args, [], files, venv_dir=None, testing_stdlib=True, non_types_dependencies=False)
-    return TestResult(result, len(files))
+    description = f"{files_checked} files" if len(shards) == 1 else f"{files_checked} files in {len(shards)} shards"
+    print(f"Testing stdlib ({description})... ", end="", flush=True, file=output)
+    if len(shards) == 1:
+        [(task, shard_files)] = shards.items()
+        processes = [test_stdlib_shard(args, task, shard_files, output, cache_root=cache_root)]
+    else:
 
+        def test_shard(task: str) -> subprocess.CompletedProcess[str] | None:
+            return test_stdlib_shard(args, task, shards[task], output, cache_root=cache_root)
+
+        # The shards are independent of each other, so they are all checked at the same time
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(shards)) as shard_executor:
+            processes = list(shard_executor.map(test_shard, shards))
+    checked = [process for process in processes if process is not None]
+    if not checked:
+        print_cached_success(output)
+        return TestResult(MypyResult.SUCCESS, files_checked)
+    process = merge_processes(checked)
+    print_mypy_result(args, process, non_types_dependencies=False, venv_dir=None, output=output)
+    return TestResult(MypyResult.from_process_result(process), files_checked)
 
-def remove_modules_not_in_python_version(paths: list[Path], py_version: VersionString) -> list[Path]:
-    py_version_tuple = tuple(map(int, py_version.split(".")))
-    module_versions = parse_stdlib_versions_file()
-    new_paths: list[Path] = []
-    for path in paths:
-        if path.parts[0] != "stdlib" or path.suffix != ".pyi":
-            continue
-        module_name = stdlib_module_name_from_path(path)
-        min_version, max_version = supported_versions_for_module(module_versions, module_name)
-        if min_version <= py_version_tuple <= max_version:
-            new_paths.append(path)
-    return new_paths
 
+def version_tuple(version: VersionString) -> VersionTuple:
+    major, minor = version.split(".")
+    return int(major), int(minor)
 
-def stdlib_module_name_from_path(path: Path) -> str:
-    assert path.parts[0] == "stdlib"
-    assert path.suffix == ".pyi"
-    parts = list(path.parts[1:-1])
-    if path.parts[-1] != "__init__.pyi":
-        parts.append(path.parts[-1].removesuffix(".pyi"))
-    return ".".join(parts)
+
+def remove_modules_not_in_python_version(paths: list[Path], py_version: VersionString) -> list[Path]:
+    version_files = get_stdlib_versions_index().files_for_version(version_tuple(py_version))
+    return [path for path in paths if path in version_files]
 
 
 @dataclass
@@ -338,6 +1116,8 @@ class TestSummary:
     mypy_result: MypyResult = MypyResult.SUCCESS
     files_checked: int = 0
     packages_skipped: int = 0
+    # Skipped packages that are only tested on COLLAPSED_PLATFORM
+    packages_collapsed: int = 0
     packages_with_errors: int = 0
 
     def register_result(self, mypy_result: MypyResult, files_checked: int) -> None:
@@ -347,27 +1127,33 @@ class TestSummary:
             self.packages_with_errors += 1
         self.files_checked += files_checked
 
-    def skip_package(self) -> None:
+    def skip_package(self, *, collapsed: bool = False) -> None:
         self.packages_skipped += 1
+        if collapsed:
+            self.packages_collapsed += 1
 
     def merge(self, other: TestSummary) -> None:
         if other.mypy_result.value > self.mypy_result.value:
             self.mypy_result = other.mypy_result
         self.files_checked += other.files_checked
         self.packages_skipped += other.packages_skipped
+        self.packages_collapsed += other.packages_collapsed
         self.packages_with_errors += other.packages_with_errors
 
 
 _PRINT_LOCK = Lock()
-_DISTRIBUTION_TO_VENV_MAPPING: dict[str, Path | None] = {}
+_VENV_SETUP_LOCK = Lock()
+# The venv to use for each distribution, or None if it doesn't need one.
+# Venvs are set up in the background, so these resolve as soon as the venv is ready.
+_DISTRIBUTION_TO_VENV_MAPPING: dict[str, concurrent.futures.Future[Path | None]] = {}
 
 
 def setup_venv_for_external_requirements_set(
-    requirements_set: frozenset[Requirement], tempdir: Path, args: TestConfig
+    requirements_set: frozenset[Requirement], tempdir: Path, verbose: int
 ) -> tuple[frozenset[Requirement], Path]:
     venv_dir = tempdir / f".venv-{hash(requirements_set)}"
     uv_command = ["uv", "venv", str(venv_dir)]
-    if not args.verbose:
+    if not verbose:
         uv_command.append("--quiet")
     subprocess.run(uv_command, check=True)
     return requirements_set, venv_dir
@@ -375,102 +1161,162 @@ def setup_venv_for_external_requirements_set(
 
 def install_requirements_for_venv(venv_dir: Path, args: TestConfig, external_requirements: frozenset[Requirement]) -> None:
     req_args = sorted(str(req) for req in external_requirements)
-    # Use --no-cache-dir to avoid issues with concurrent read/writes to the cache
-    uv_command = ["uv", "pip", "install", get_mypy_req(), *req_args, "--no-cache-dir"]
-    if args.verbose:
-        with _PRINT_LOCK:
-            print(colored(f"Running {uv_command}", "blue"))
-    else:
-        uv_command.append("--quiet")
+    uv_cache = args.uv_cache or UvCache()
     try:
-        subprocess.run(uv_command, check=True, text=True, env={**os.environ, "VIRTUAL_ENV": str(venv_dir)})
+        uv_cache.install(venv_dir, [get_mypy_req(), *req_args], verbose=bool(args.verbose))
     except subprocess.CalledProcessError as e:
         print(e.stderr)
         raise
 
 
+def create_venv(requirements_set: frozenset[Requirement], args: TestConfig, tempdir: Path) -> Path:
+    """Create a venv with the requirements installed, or get it from the persistent venv cache."""
+    if args.venv_cache is not None:
+        return args.venv_cache.get([get_mypy_req(), *map(str, requirements_set)], verbose=bool(args.verbose))
+    _, venv_dir = setup_venv_for_external_requirements_set(requirements_set, tempdir, args.verbose)
+    install_requirements_for_venv(venv_dir, args, requirements_set)
+    return venv_dir
+
+
+def merge_external_requirements(
+    external_requirements_to_distributions: dict[frozenset[Requirement], list[str]], args: TestConfig
+) -> defaultdict[frozenset[Requirement], list[str]]:
+    """Group the distributions by the requirements of the shared venvs they can use."""
+    start_time = time.perf_counter()
+    plan = merge_requirement_sets(external_requirements_to_distributions, base=[get_mypy_req()])
+    merged: defaultdict[frozenset[Requirement], list[str]] = defaultdict(list)
+    for requirements_set, distribution_list in external_requirements_to_distributions.items():
+        merged[plan[requirements_set]].extend(distribution_list)
+    if args.verbose:
+        num_sets = len(external_requirements_to_distributions)
+        msg = f"Resolved {num_sets} sets of non-types dependencies in {time.perf_counter() - start_time:.2f} seconds"
+        with _PRINT_LOCK:
+            print(colored(msg, "blue"))
+        for requirements_set, distribution_list in merged.items():
+            log(args, f"Sharing a venv with {sorted(map(str, requirements_set))} between {sorted(distribution_list)}")
+    return merged
+
+
+def resolve_venv_futures(
+    futures: list[concurrent.futures.Future[Path | None]], venv_future: concurrent.futures.Future[Path]
+) -> None:
+    exception = venv_future.exception()
+    for future in futures:
+        if exception is None:
+            future.set_result(venv_future.result())
+        else:
+            future.set_exception(exception)
+
+
+def create_venvs(
+    external_requirements_to_distributions: dict[frozenset[Requirement], list[str]],
+    venv_futures: dict[str, concurrent.futures.Future[Path | None]],
+    args: TestConfig,
+    tempdir: Path,
+) -> None:
+    """Set up a venv for each set of external requirements, resolving the futures of each venv's distributions."""
+    start_time = time.perf_counter()
+    try:
+        # Merge requirement sets that can share a virtual environment
+        if args.merge_venvs and len(external_requirements_to_distributions) > 1:
+            external_requirements_to_distributions = merge_external_requirements(external_requirements_to_distributions, args)
+
+        if args.verbose:
+            num_venvs = len(external_requirements_to_distributions)
+            msg = (
+                f"Setting up {num_venvs} venv{'s' if num_venvs != 1 else ''} "
+                f"for {len(venv_futures)} distribution{'s' if len(venv_futures) != 1 else ''}"
+            )
+            with _PRINT_LOCK:
+                print(colored(msg, "blue"))
+
+        # Limit workers to 10 at a time, since this makes network requests
+        with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
+            for requirements_set, distribution_list in external_requirements_to_distributions.items():
+                venv_future = executor.submit(create_venv, requirements_set, args, tempdir)
+                venv_future.add_done_callback(partial(resolve_venv_futures, [venv_futures[dist] for dist in distribution_list]))
+    except BaseException as e:
+        for future in venv_futures.values():
+            if not future.done():
+                future.set_exception(e)
+        raise
+
+    if args.verbose:
+        with _PRINT_LOCK:
+            print(colored(f"All venvs were ready after {time.perf_counter() - start_time:.2f} seconds", "blue"))
+
+
 def setup_virtual_environments(distributions: dict[str, PackageDependencies], args: TestConfig, tempdir: Path) -> None:
-    """Logic necessary for testing stubs with non-types dependencies in isolated environments."""
+    """Logic necessary for testing stubs with non-types dependencies in isolated environments.
+
+    Every distribution gets a future in `_DISTRIBUTION_TO_VENV_MAPPING` that resolves to the venv it should use.
+    With `args.venv_workers`, the venvs are set up in the background,
+    so that distributions can be tested while the venvs of other distributions are still being set up.
+    """
     if not distributions:
         return  # hooray! Nothing to do
 
     # STAGE 1: Determine which (if any) stubs packages require virtual environments.
     # Group stubs packages according to their external-requirements sets
     external_requirements_to_distributions: defaultdict[frozenset[Requirement], list[str]] = defaultdict(list)
-    num_pkgs_with_external_reqs = 0
+    venv_futures: dict[str, concurrent.futures.Future[Path | None]] = {}
 
     for distribution_name, requirements in distributions.items():
+        future: concurrent.futures.Future[Path | None] = concurrent.futures.Future()
+        _DISTRIBUTION_TO_VENV_MAPPING[distribution_name] = future
         if requirements.external_pkgs:
-            num_pkgs_with_external_reqs += 1
             external_requirements = frozenset(requirements.external_pkgs)
             external_requirements_to_distributions[external_requirements].append(distribution_name)
+            venv_futures[distribution_name] = future
         else:
-            _DISTRIBUTION_TO_VENV_MAPPING[distribution_name] = None
+            future.set_result(None)
 
     # Exit early if there are no stubs packages that have non-types dependencies
-    if num_pkgs_with_external_reqs == 0:
+    if not venv_futures:
         if args.verbose:
             print(colored("No additional venvs are required to be set up", "blue"))
         return
 
     # STAGE 2: Setup a virtual environment for each unique set of external requirements
-    requirements_sets_to_venvs: dict[frozenset[Requirement], Path] = {}
-
-    if args.verbose:
-        num_venvs = len(external_requirements_to_distributions)
-        msg = (
-            f"Setting up {num_venvs} venv{'s' if num_venvs != 1 else ''} "
-            f"for {num_pkgs_with_external_reqs} "
-            f"distribution{'s' if num_pkgs_with_external_reqs != 1 else ''}... "
-        )
-        print(colored(msg, "blue"), end="", flush=True)
-
-    venv_start_time = time.perf_counter()
-
-    with concurrent.futures.ProcessPoolExecutor() as executor:
-        venv_futures = [
-            executor.submit(setup_venv_for_external_requirements_set, requirements_set, tempdir, args)
-            for requirements_set in external_requirements_to_distributions
-        ]
-        for venv_future in concurrent.futures.as_completed(venv_futures):
-            requirements_set, venv_dir = venv_future.result()
-            requirements_sets_to_venvs[requirements_set] = venv_dir
+    # and install the requirements into it
+    if args.venv_workers is None:
+        create_venvs(external_requirements_to_distributions, venv_futures, args, tempdir)
+    else:
+        args.venv_workers.submit(create_venvs, external_requirements_to_distributions, venv_futures, args, tempdir)
 
-    venv_elapsed_time = time.perf_counter() - venv_start_time
 
-    if args.verbose:
-        print(colored(f"took {venv_elapsed_time:.2f} seconds", "blue"))
+def pop_ready_task(tasks: list[list[str]]) -> list[str] | None:
+    """Remove and return the first task whose venvs are ready, if there is one."""
+    for index, task in enumerate(tasks):
+        if all(_DISTRIBUTION_TO_VENV_MAPPING[distribution].done() for distribution in task):
+            return tasks.pop(index)
+    return None
 
-    # STAGE 3: For each {virtual_environment: requirements_set} pairing,
-    # `uv pip install` the requirements set into the virtual environment
-    pip_start_time = time.perf_counter()
 
-    # Limit workers to 10 at a time, since this makes network requests
-    with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-        pip_install_futures = [
-            executor.submit(install_requirements_for_venv, venv_dir, args, requirements_set)
-            for requirements_set, venv_dir in requirements_sets_to_venvs.items()
-        ]
-        concurrent.futures.wait(pip_install_futures)
+def pending_venvs(tasks: Iterable[list[str]]) -> set[concurrent.futures.Future[Path | None]]:
+    """Return the venvs the tasks are still waiting for."""
+    return {
+        future for task in tasks for distribution in task if not (future := _DISTRIBUTION_TO_VENV_MAPPING[distribution]).done()
+    }
 
-    pip_elapsed_time = time.perf_counter() - pip_start_time
 
-    if args.verbose:
-        msg = f"Combined time for installing requirements across all venvs: {pip_elapsed_time:.2f} seconds"
-        print(colored(msg, "blue"))
+def print_buffered_output(buffer: io.StringIO, output: TextIO | None = None) -> None:
+    """Print the output that was collected for a single task in one go.
 
-    # STAGE 4: Populate the _DISTRIBUTION_TO_VENV_MAPPING
-    # so that we have a simple {distribution: venv_to_use} mapping to use for the rest of the test.
-    for requirements_set, distribution_list in external_requirements_to_distributions.items():
-        venv_to_use = requirements_sets_to_venvs[requirements_set]
-        _DISTRIBUTION_TO_VENV_MAPPING.update(dict.fromkeys(distribution_list, venv_to_use))
+    This stops the output of concurrently running tasks from being interleaved.
+    """
+    with _PRINT_LOCK:
+        print(buffer.getvalue(), end="", flush=True, file=output)
 
 
-def test_third_party_stubs(args: TestConfig, tempdir: Path) -> TestSummary:
-    print("Testing third-party packages...")
+def test_third_party_stubs(
+    args: TestConfig, tempdir: Path, executor: concurrent.futures.Executor | None = None, output: TextIO | None = None
+) -> TestSummary:
+    print("Testing third-party packages...", file=output)
     summary = TestSummary()
     gitignore_spec = get_gitignore_spec()
     distributions_to_check: dict[str, PackageDependencies] = {}
+    collapsed: list[str] = []
 
     for distribution in sorted(os.listdir("stubs")):
         dist_path = distribution_path(distribution)
@@ -478,6 +1324,12 @@ def test_third_party_stubs(args: TestConfig, tempdir: Path) -> TestSummary:
         if spec_matches_path(gitignore_spec, dist_path):
             continue
 
+        if args.changed is not None and not args.changed.includes_distribution(distribution):
+            continue
+
+        if args.shard is not None and distribution not in args.shard:
+            continue
+
         if dist_path in args.filter or STUBS_PATH in args.filter or any(dist_path in path.parents for path in args.filter):
             metadata = read_metadata(distribution)
             if not metadata.requires_python.contains(PYTHON_VERSION):
@@ -485,13 +1337,15 @@ def test_third_party_stubs(args: TestConfig, tempdir: Path) -> TestSummary:
                     f"skipping {distribution!r} (requires Python {metadata.requires_python}; "
                     f"test is being run using Python {PYTHON_VERSION})"
                 )
-                print(colored(msg, "yellow"))
+                print(colored(msg, "yellow"), file=output)
                 summary.skip_package()
+                report_skipped(args, distribution, msg)
                 continue
             if not metadata.requires_python.contains(args.version):
                 msg = f"skipping {distribution!r} for target Python {args.version} (requires Python {metadata.requires_python})"
-                print(colored(msg, "yellow"))
+                print(colored(msg, "yellow"), file=output)
                 summary.skip_package()
+                report_skipped(args, distribution, msg)
                 continue
 
             requirements = get_recursive_requirements(distribution)
@@ -500,69 +1354,269 @@ def test_third_party_stubs(args: TestConfig, tempdir: Path) -> TestSummary:
                     f"skipping {distribution!r} for target Python {args.version} "
                     "(runtime dependencies do not support 3.15 yet)"
                 )
-                print(colored(msg, "yellow"))
+                print(colored(msg, "yellow"), file=output)
                 summary.skip_package()
+                report_skipped(args, distribution, msg)
                 continue
 
+            if args.collapse_platforms and args.platform != COLLAPSED_PLATFORM:
+                sensitivity = platform_sensitivity(distribution)
+                if args.verbose:
+                    print(colored(sensitivity.describe(), "blue"), file=output)
+                if not sensitivity.sensitive:
+                    collapsed.append(distribution)
+                    summary.skip_package(collapsed=True)
+                    report_skipped(args, distribution, f"{sensitivity.describe()}; only tested on {COLLAPSED_PLATFORM}")
+                    continue
+
             distributions_to_check[distribution] = requirements
 
+    if collapsed:
+        plural = "" if len(collapsed) == 1 else "s"
+        msg = f"{len(collapsed)} distribution{plural} that don't depend on the platform are only tested on {COLLAPSED_PLATFORM}"
+        print(colored(msg, "blue"), file=output)
+
     # Setup the necessary virtual environments for testing the third-party stubs.
     # Note that some stubs may not be tested on all Python versions
     # (due to version incompatibilities),
     # so we can't guarantee that setup_virtual_environments()
     # will only be called once per session.
-    distributions_without_venv = {
-        distribution: requirements
-        for distribution, requirements in distributions_to_check.items()
-        if distribution not in _DISTRIBUTION_TO_VENV_MAPPING
-    }
-    setup_virtual_environments(distributions_without_venv, args, tempdir)
+    # With --concurrent-matrix, several versions may get to this point at the same time;
+    # the lock makes sure that each venv is only created once for the whole matrix.
+    with _VENV_SETUP_LOCK:
+        distributions_without_venv = {
+            distribution: requirements
+            for distribution, requirements in distributions_to_check.items()
+            if distribution not in _DISTRIBUTION_TO_VENV_MAPPING
+        }
+        setup_virtual_environments(distributions_without_venv, args, tempdir)
 
     # Check that there is a venv for every distribution we're testing.
     # Some venvs may exist from previous runs but are skipped in this run.
     assert _DISTRIBUTION_TO_VENV_MAPPING.keys() >= distributions_to_check.keys()
 
-    for distribution in distributions_to_check:
-        venv_dir = _DISTRIBUTION_TO_VENV_MAPPING[distribution]
-        non_types_dependencies = venv_dir is not None
-        mypy_result, files_checked = test_third_party_distribution(
-            distribution, args, venv_dir=venv_dir, non_types_dependencies=non_types_dependencies
-        )
-        summary.register_result(mypy_result, files_checked)
+    cache_root = tempdir / ".mypy_cache" / args.version / args.platform
+    if args.batch_size > 1:
+        batchable = [
+            distribution
+            for distribution in distributions_to_check
+            if not distributions_to_check[distribution].external_pkgs and not mypy_configuration_from_distribution(distribution)
+        ]
+        tasks = batch_distributions(batchable, args.batch_size)
+        tasks.extend([distribution] for distribution in distributions_to_check if distribution not in batchable)
+    else:
+        tasks = [[distribution] for distribution in distributions_to_check]
+
+    # Distributions without non-types dependencies can be tested right away;
+    # the others are tested as soon as their venv is ready.
+    if executor is None:
+        while tasks:
+            task = pop_ready_task(tasks)
+            if task is None:
+                concurrent.futures.wait(pending_venvs(tasks), return_when=concurrent.futures.FIRST_COMPLETED)
+                continue
+            task_results = test_third_party_task(
+                task, args, cache_root=cache_root if args.shared_stdlib_cache else None, output=output
+            )
+            for mypy_result, files_checked in task_results:
+                summary.register_result(mypy_result, files_checked)
+        return summary
+
+    # Concurrently running mypy processes must not share a cache directory,
+    # see https://github.com/python/mypy/issues/13916
+    # Start the slowest tasks first, so that they don't end up at the tail of the queue
+    if args.timings is not None:
+        timings = args.timings
+        tasks = longest_first(tasks, lambda task: sum(timings.estimate(distribution) for distribution in task))
+    # Only submit as many tasks as there are workers, so that a task whose venv has just become ready
+    # doesn't have to wait behind all tasks that were submitted before.
+    futures: dict[concurrent.futures.Future[list[TestResult]], io.StringIO] = {}
+    while tasks or futures:
+        while len(futures) < args.jobs and (task := pop_ready_task(tasks)) is not None:
+            buffer = io.StringIO()
+            future = executor.submit(test_third_party_task, task, args, cache_root=cache_root, output=buffer)
+            futures[future] = buffer
+
+        waiting_for: set[concurrent.futures.Future[Any]] = set(futures)
+        if len(futures) < args.jobs:
+            waiting_for |= pending_venvs(tasks)
+        done, _ = concurrent.futures.wait(waiting_for, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            if future not in futures:
+                continue  # A venv is ready
+            print_buffered_output(futures.pop(future), output)
+            for mypy_result, files_checked in future.result():
+                summary.register_result(mypy_result, files_checked)
 
     return summary
 
 
-def test_typeshed(args: TestConfig, tempdir: Path) -> TestSummary:
-    print(f"*** Testing Python {args.version} on {args.platform}")
+def test_typeshed(
+    args: TestConfig, tempdir: Path, executor: concurrent.futures.Executor | None = None, output: TextIO | None = None
+) -> TestSummary:
+    print(f"*** Testing Python {args.version} on {args.platform}", file=output)
     summary = TestSummary()
 
-    if STDLIB_PATH in args.filter or any(STDLIB_PATH in path.parents for path in args.filter):
-        mypy_result, files_checked = test_stdlib(args)
+    stdlib_selected = (args.changed is None or args.changed.includes_stdlib()) and (
+        args.shard is None or not args.shard.isdisjoint(stdlib_targets(args.stdlib_shards))
+    )
+    if stdlib_selected and (STDLIB_PATH in args.filter or any(STDLIB_PATH in path.parents for path in args.filter)):
+        if executor is None:
+            mypy_result, files_checked = test_stdlib(args, output)
+        else:
+            buffer = io.StringIO()
+            cache_root = tempdir / ".mypy_cache" / args.version / args.platform
+            mypy_result, files_checked = executor.submit(test_stdlib, args, buffer, cache_root=cache_root).result()
+            print_buffered_output(buffer, output)
         summary.register_result(mypy_result, files_checked)
-        print()
+        print(file=output)
 
     if STUBS_PATH in args.filter or any(STUBS_PATH in path.parents for path in args.filter):
-        tp_results = test_third_party_stubs(args, tempdir)
+        tp_results = test_third_party_stubs(args, tempdir, executor, output)
         summary.merge(tp_results)
-        print()
+        print(file=output)
 
     return summary
 
 
+def test_typeshed_matrix(
+    configs: list[TestConfig], tempdir: Path, executor: concurrent.futures.Executor
+) -> Generator[TestSummary]:
+    """Run `test_typeshed` for all configurations at once.
+
+    All mypy runs are scheduled into `executor`.
+    The output for each configuration is printed in the usual order
+    as soon as all mypy runs for that configuration have completed,
+    and the summary for each configuration is yielded in the same order.
+    """
+    # These threads only wait for the mypy runs in `executor` to complete,
+    # so there can be one for each configuration
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(configs)) as matrix_executor:
+        futures: list[tuple[concurrent.futures.Future[TestSummary], io.StringIO]] = []
+        for config in configs:
+            buffer = io.StringIO()
+            futures.append((matrix_executor.submit(test_typeshed, config, tempdir, executor, buffer), buffer))
+        for future, buffer in futures:
+            summary = future.result()
+            print_buffered_output(buffer)
+            yield summary
+
+
 def main() -> None:
     args = parser.parse_args(namespace=CommandLineArgs())
+    if args.stop_daemons:
+        stopped = stop_daemons()
+        print(colored(f"--- stopped {stopped} mypy daemon{'' if stopped == 1 else 's'} ---", "green"))
+        return
+    if args.profile and (args.daemon or args.shared_stdlib_cache or args.result_cache):
+        parser.error("--profile can't be combined with --daemon, --shared-stdlib-cache or --result-cache")
+    if args.stdlib_shards < 1:
+        parser.error(f"--stdlib-shards must be positive, not {args.stdlib_shards}")
+    if args.stdlib_shards != 1 and args.daemon:
+        parser.error("--stdlib-shards can't be combined with --daemon")
     versions = args.python_version or SUPPORTED_VERSIONS
     platforms = args.platform or [sys.platform]
+    if args.daemon:
+        if not args.filter:
+            parser.error(
+                "--daemon starts a daemon for every distribution, Python version and platform, so it needs paths to test"
+            )
+        daemons = len(daemon_targets(args.filter)) * len(versions) * len(platforms)
+        if daemons > MAX_DAEMONS_WITHOUT_WARNING:
+            msg = (
+                f"Warning: --daemon may start up to {daemons} mypy daemons, which keep running until they have been idle "
+                f"for {DAEMON_TIMEOUT // 60} minutes; use --stop-daemons to stop them earlier"
+            )
+            print(colored(msg, "yellow"))
     path_filter = args.filter or DIRECTORIES_TO_TEST
     exclude = args.exclude or []
+    jobs = args.jobs or os.cpu_count() or 1
+    changed = None
+    if args.changed_since is not None:
+        try:
+            changed = changed_targets(args.changed_since)
+        except RuntimeError as e:
+            parser.error(str(e))
+        print(colored(f"Testing changes since {args.changed_since}: {changed.describe()}", "blue"))
+    timings = Timings("mypy_test")
+    peak_memory = PeakMemory("mypy_test")
+    shard_targets = None
+    if args.num_shards != 1:
+        stdlib_tasks = stdlib_targets(args.stdlib_shards)
+        candidates = [
+            target
+            for target in [*stdlib_targets(args.stdlib_shards), *sorted(os.listdir(STUBS_PATH))]
+            if changed is None or (changed.includes_stdlib() if target in stdlib_tasks else changed.includes_distribution(target))
+        ]
+        try:
+            shard_targets = frozenset(shard(candidates, args.num_shards, args.shard_index, timings.estimate))
+        except ValueError as e:
+            parser.error(str(e))
+    report = Report("mypy_test") if args.report or args.junit_xml else None
+    if args.collapse_platforms and any(platform != COLLAPSED_PLATFORM for platform in platforms):
+        # Analyse the stdlib once, rather than in each of the concurrently tested configurations
+        platform_dependent_stdlib_names()
+    profile = Profile() if args.profile else None
     summary = TestSummary()
-    with tempfile.TemporaryDirectory() as td:
+    with tempfile.TemporaryDirectory() as td, ExitStack() as stack:
         td_path = Path(td)
-        for version, platform in product(versions, platforms):
-            config = TestConfig(args.verbose, path_filter, exclude, version, platform)
-            version_summary = test_typeshed(args=config, tempdir=td_path)
-            summary.merge(version_summary)
+        executor = None
+        if jobs > 1 or args.concurrent_matrix:
+            executor = stack.enter_context(concurrent.futures.ThreadPoolExecutor(max_workers=jobs))
+        uv_cache = UvCache()
+        venv_workers = stack.enter_context(concurrent.futures.ThreadPoolExecutor())
+        memory_budget = MemoryBudget(args.max_memory, peak_memory)
+        venv_cache = stack.enter_context(VenvCache(uv_cache=uv_cache)) if args.venv_cache else None
+        mypy_workers = None
+        if args.in_process:
+            mypy_workers = stack.enter_context(
+                concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=init_mypy_worker)
+            )
+        configs = [
+            TestConfig(
+                args.verbose,
+                path_filter,
+                exclude,
+                version,
+                platform,
+                mypy_workers=mypy_workers,
+                daemon=args.daemon,
+                shared_stdlib_cache=args.shared_stdlib_cache,
+                batch_size=args.batch_size,
+                result_cache=ResultCache(Path(__file__)) if args.result_cache else None,
+                changed=changed,
+                shard=shard_targets,
+                timings=timings,
+                report=report,
+                venv_cache=venv_cache,
+                merge_venvs=not args.isolated_venvs,
+                uv_cache=uv_cache,
+                venv_workers=venv_workers,
+                jobs=jobs,
+                memory_budget=memory_budget,
+                profile=profile,
+                stdlib_shards=args.stdlib_shards,
+                collapse_platforms=args.collapse_platforms,
+            )
+            for version, platform in product(versions, platforms)
+        ]
+        if args.concurrent_matrix:
+            assert executor is not None
+            for version_summary in test_typeshed_matrix(configs, td_path, executor):
+                summary.merge(version_summary)
+        else:
+            for config in configs:
+                version_summary = test_typeshed(args=config, tempdir=td_path, executor=executor)
+                summary.merge(version_summary)
+        if uv_cache.installs:
+            print(colored(uv_cache.summary(), "blue"))
+    timings.save()
+    peak_memory.save()
+    if report is not None:
+        report.write(args.report, args.junit_xml)
+    if profile is not None:
+        print(profile.format_report())
+        profile.write_json()
 
     if summary.mypy_result == MypyResult.FAILURE:
         plural1 = "" if summary.packages_with_errors == 1 else "s"
@@ -581,6 +1635,12 @@ def main() -> None:
     if summary.files_checked:
         plural = "" if summary.files_checked == 1 else "s"
         print(colored(f"--- success, {summary.files_checked} file{plural} checked ---", "green"))
+    elif changed is not None:
+        print(colored(f"--- nothing to test for the changes since {args.changed_since} ---", "green"))
+    elif shard_targets is not None:
+        print(colored(f"--- nothing to test in shard {args.shard_index} ---", "green"))
+    elif summary.packages_collapsed:
+        print(colored(f"--- nothing to test; the packages are only tested on {COLLAPSED_PLATFORM} ---", "green"))
     else:
         print_error("--- nothing to do; exit 1 ---")
         sys.exit(1)
@@ -5,6 +5,8 @@ from __future__ import annotations
 
 import argparse
 import concurrent.futures
+import hashlib
+import multiprocessing
 import os
 import queue
 import re
@@ -13,20 +15,35 @@ import subprocess
 import sys
 import tempfile
 import threading
+import time
 from abc import ABCMeta, abstractmethod
-from collections.abc import Callable, Generator
-from contextlib import ExitStack, contextmanager, suppress
+from collections import Counter
+from collections.abc import Generator
+from contextlib import ExitStack, contextmanager, nullcontext, suppress
 from dataclasses import dataclass
 from enum import IntEnum
 from functools import partial
+from itertools import product
 from pathlib import Path
 from typing import TypeAlias
 from typing_extensions import override
 
+from ts_utils.changes import changed_targets
+from ts_utils.memory import PEAK_MEMORY_PATH, MemoryBudget, PeakMemory, parse_memory_size
 from ts_utils.metadata import get_recursive_requirements, read_metadata
-from ts_utils.mypy import mypy_configuration_from_distribution, temporary_mypy_config_file
+from ts_utils.mypy import (
+    STDLIB_CACHE_DIR,
+    copy_prewarmed_stdlib_cache,
+    mypy_configuration_from_distribution,
+    run_mypy_in_worker,
+    temporary_mypy_config_file,
+)
 from ts_utils.paths import STDLIB_PATH, TEST_CASES_DIR, TS_BASE_PATH, distribution_path
+from ts_utils.platforms import COLLAPSED_PLATFORM, platform_sensitivity
 from ts_utils.py315 import PY315_INCOMPATIBLE_RUNTIME_DEPENDENCIES
+from ts_utils.report import MeasuredProcess, Report, TaskStatus, run_measured
+from ts_utils.result_cache import RESULT_CACHE_PATH, ResultCache, stub_closure_digest
+from ts_utils.timings import TIMINGS_PATH, Timings, longest_first, shard
 from ts_utils.utils import (
     PYTHON_VERSION,
     DistributionTests,
@@ -34,15 +51,16 @@ from ts_utils.utils import (
     distribution_info,
     get_all_testcase_directories,
     get_mypy_req,
+    link_tree,
     print_error,
     print_skipped,
     venv_python,
 )
+from ts_utils.venvs import VENV_CACHE_PATH, UvCache, VenvCache
 
 ReturnCode: TypeAlias = int
 
 VENV_DIR = ".venv"
-TYPESHED = "typeshed"
 
 SUPPORTED_PLATFORMS = ["linux", "darwin", "win32"]
 SUPPORTED_VERSIONS = ["3.15", "3.14", "3.13", "3.12", "3.11", "3.10"]
@@ -110,6 +128,72 @@ parser.add_argument(
         "Note that this cannot be specified if --all is also specified."
     ),
 )
+parser.add_argument(
+    "--collapse-platforms",
+    action="store_true",
+    help=(
+        f"Only run the test cases of packages that can't give different results on different platforms on {COLLAPSED_PLATFORM}, "
+        "and skip them for other platforms. Use --verbosity=VERBOSE to see why each package is or isn't skipped"
+    ),
+)
+parser.add_argument(
+    "--max-memory",
+    type=parse_memory_size,
+    metavar="SIZE",
+    help=(
+        "Only start a mypy run if the expected peak memory usage of all running mypy processes stays below SIZE "
+        f"(e.g. 8G), based on the usage recorded by earlier runs in {PEAK_MEMORY_PATH}"
+    ),
+)
+parser.add_argument(
+    "--fork-server",
+    action="store_true",
+    help=(
+        "Run mypy in worker processes that are forked from a server process that has already imported mypy. "
+        "Each run starts from its own copy of a mypy cache of the stdlib, which is built once for each "
+        f"Python version and platform (stored in {STDLIB_CACHE_DIR} for the stdlib test cases, "
+        "and once per test run for each isolated typeshed directory of the third-party test cases). "
+        "Test cases of packages with non-types dependencies still run mypy in a subprocess. Not available on Windows"
+    ),
+)
+parser.add_argument(
+    "--num-shards",
+    type=int,
+    default=1,
+    help=(
+        "Split the packages into shards of similar total runtime, based on the durations of their test runs "
+        f"(one per Python version and platform) in {TIMINGS_PATH}, and only test one of them"
+    ),
+)
+parser.add_argument("--shard-index", type=int, default=0, help="The shard to run when using --num-shards")
+parser.add_argument(
+    "--result-cache",
+    action="store_true",
+    help=(
+        "Only check the test case files that haven't passed before with the same contents, stubs and settings, "
+        f"and remember the ones that pass (stored in {RESULT_CACHE_PATH})"
+    ),
+)
+parser.add_argument(
+    "--report",
+    type=Path,
+    metavar="PATH",
+    help="Write a JSON report with the outcome, duration and resource usage of every test run to this file",
+)
+parser.add_argument("--junit-xml", type=Path, metavar="PATH", help="Write a JUnit XML report to this file")
+parser.add_argument(
+    "--venv-cache",
+    action="store_true",
+    help=f"Keep the venvs for packages with non-types dependencies in {VENV_CACHE_PATH}, and reuse them in later runs",
+)
+parser.add_argument(
+    "--changed-since",
+    metavar="REV",
+    help=(
+        "Only run the test cases of packages changed since the merge base of this git revision, "
+        "and of the packages that depend on them. Changes to the stdlib select everything"
+    ),
+)
 
 _PRINT_QUEUE: queue.SimpleQueue[str] = queue.SimpleQueue()
 
@@ -118,7 +202,60 @@ def verbose_log(msg: str) -> None:
     _PRINT_QUEUE.put(colored(msg, "blue"))
 
 
-def setup_testcase_dir(package: DistributionTests, tempdir: Path, verbosity: Verbosity) -> None:
+# Venvs from the persistent venv cache, for packages that don't use a venv in their temporary directory
+_CACHED_VENVS: dict[str, Path] = {}
+
+
+class TypeshedSnapshots:
+    """Isolated typeshed directories for the third-party test cases.
+
+    A snapshot contains the stdlib and the stubs of some typeshed dependencies (plus mypy-extensions).
+    Packages that depend on the same stubs share a snapshot, into which their own stubs are linked as well.
+    mypy only finds third-party stubs through MYPYPATH, which only lists the stubs of the package
+    that is being tested and of its dependencies, so it never sees the other packages in a snapshot.
+    """
+
+    def __init__(self, directory: Path) -> None:
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._snapshots: dict[frozenset[str], Path] = {}
+        # The snapshot and the stubs on MYPYPATH of each package
+        self._packages: dict[str, tuple[Path, list[str]]] = {}
+
+    def add(self, package: str) -> Path:
+        """Make sure that there's a snapshot containing the package and its dependencies, and return it."""
+        requirements = get_recursive_requirements(package)
+        # mypy refuses to consider a directory a "valid typeshed directory"
+        # unless there's a stubs/mypy-extensions path inside it
+        dependencies = frozenset({*(r.name for r in requirements.typeshed_pkgs), "mypy-extensions"}) - {package}
+        with self._lock:
+            snapshot = self._snapshots.get(dependencies)
+            if snapshot is None:
+                snapshot = self.directory / str(len(self._snapshots))
+                link_tree(STDLIB_PATH, snapshot / "stdlib")
+                for dependency in dependencies:
+                    link_tree(distribution_path(dependency), snapshot / "stubs" / dependency)
+                self._snapshots[dependencies] = snapshot
+            link_tree(distribution_path(package), snapshot / "stubs" / package)
+            self._packages[package] = (snapshot, sorted({package, *dependencies}))
+        return snapshot
+
+    def snapshot(self, package: str) -> Path:
+        return self._packages[package][0]
+
+    def mypypath(self, package: str) -> str:
+        snapshot, stubs = self._packages[package]
+        return os.pathsep.join(str(snapshot / "stubs" / name) for name in stubs)
+
+
+def setup_testcase_dir(
+    package: DistributionTests,
+    tempdir: Path,
+    verbosity: Verbosity,
+    snapshots: TypeshedSnapshots,
+    venv_cache: VenvCache | None = None,
+    uv_cache: UvCache | None = None,
+) -> None:
     if verbosity is verbosity.VERBOSE:
         verbose_log(f"{package.name}: Setting up testcase dir in {tempdir}")
     # --warn-unused-ignores doesn't work for files inside typeshed.
@@ -135,44 +272,64 @@ def setup_testcase_dir(package: DistributionTests, tempdir: Path, verbosity: Ver
     #
     # The best way of doing that without stopping --warn-unused-ignore from working
     # seems to be to create a "new typeshed" directory in a tempdir
-    # that has only the required stubs copied over.
-    new_typeshed = tempdir / TYPESHED
-    new_typeshed.mkdir()
-    shutil.copytree(STDLIB_PATH, new_typeshed / "stdlib")
+    # that only links to the required stubs. Since mypy never writes to typeshed,
+    # the stubs don't need to be copied; mypy finds them through the links just fine.
+    snapshot = snapshots.add(package.name)
+    if verbosity is Verbosity.VERBOSE:
+        verbose_log(f"{package.name}: Using the typeshed snapshot in {snapshot}")
+
     requirements = get_recursive_requirements(package.name)
-    # mypy refuses to consider a directory a "valid typeshed directory"
-    # unless there's a stubs/mypy-extensions path inside it,
-    # so add that to the list of stubs to copy over to the new directory
-    typeshed_requirements = [r.name for r in requirements.typeshed_pkgs]
-    for requirement in {package.name, *typeshed_requirements, "mypy-extensions"}:
-        shutil.copytree(distribution_path(requirement), new_typeshed / "stubs" / requirement)
-
-    if requirements.external_pkgs:
+    if requirements.external_pkgs and venv_cache is not None:
+        ext_requirements = [str(r) for r in requirements.external_pkgs]
+        if verbosity is Verbosity.VERBOSE:
+            verbose_log(f"{package.name}: Getting venv from {venv_cache.directory}")
+        try:
+            _CACHED_VENVS[package.name] = venv_cache.get([get_mypy_req(), *ext_requirements])
+        except subprocess.CalledProcessError as e:
+            _PRINT_QUEUE.put(f"{package.name}\n{e}")
+            raise
+    elif requirements.external_pkgs:
         venv_location = str(tempdir / VENV_DIR)
         subprocess.run(["uv", "venv", venv_location], check=True, capture_output=True)
         ext_requirements = [str(r) for r in requirements.external_pkgs]
-        uv_command = ["uv", "pip", "install", get_mypy_req(), *ext_requirements]
-        if sys.platform == "win32":
-            # Reads/writes to the cache are threadsafe with uv generally...
-            # but not on old Windows versions
-            # https://github.com/astral-sh/uv/issues/2810
-            uv_command.append("--no-cache-dir")
         if verbosity is Verbosity.VERBOSE:
-            verbose_log(f"{package.name}: Setting up venv in {venv_location}. {uv_command=}\n")
+            verbose_log(f"{package.name}: Setting up venv in {venv_location}\n")
+        # Installs through the uv cache of the whole test run, which counts the packages downloaded into it
+        uv_cache = uv_cache or UvCache()
         try:
-            subprocess.run(
-                uv_command, check=True, capture_output=True, text=True, env=os.environ | {"VIRTUAL_ENV": venv_location}
-            )
+            uv_cache.install(Path(venv_location), [get_mypy_req(), *ext_requirements])
         except subprocess.CalledProcessError as e:
             _PRINT_QUEUE.put(f"{package.name}\n{e.stderr}")
             raise
 
 
+def testcase_files(test_case_dir: Path, version: str) -> list[str]:
+    # If the test-case filename ends with e.g. -py314,
+    # only run the test if --python-version was set to 3.14 or higher (for example)
+    files: list[str] = []
+    for path in test_case_dir.rglob("*.py"):
+        if match := re.fullmatch(r".*-py3(\d\d)", path.stem):
+            minor_version_required = int(match[1])
+            assert f"3.{minor_version_required}" in SUPPORTED_VERSIONS
+            python_minor_version = int(version.split(".")[1])
+            if minor_version_required > python_minor_version:
+                continue
+        files.append(str(path))
+    return files
+
+
 def run_testcases(
-    package: DistributionTests, version: str, platform: str, *, tempdir: Path, verbosity: Verbosity
-) -> subprocess.CompletedProcess[str] | None:
+    package: DistributionTests,
+    version: str,
+    platform: str,
+    *,
+    tempdir: Path,
+    snapshots: TypeshedSnapshots,
+    files: list[str],
+    verbosity: Verbosity,
+    mypy_workers: concurrent.futures.Executor | None = None,
+) -> MeasuredProcess | None:
     env_vars = dict(os.environ)
-    new_test_case_dir = tempdir / TEST_CASES_DIR
 
     if package.is_stdlib:
         configurations = []
@@ -193,11 +350,6 @@ def run_testcases(
             "--pretty",
             "--config-file",
             temp_config.name,
-            # Avoid race conditions when using the cache
-            # https://github.com/python/mypy/issues/13916
-            "--no-incremental",
-            "--cache-dir",
-            str(tempdir / ".mypy_cache" / version / platform),
             # Not useful for the test cases
             "--disable-error-code=empty-body",
         ]
@@ -207,43 +359,62 @@ def run_testcases(
             custom_typeshed = TS_BASE_PATH
             flags.append("--no-site-packages")
         else:
-            custom_typeshed = tempdir / TYPESHED
-            env_vars["MYPYPATH"] = os.pathsep.join(map(str, custom_typeshed.glob("stubs/*")))
-            has_non_types_dependencies = (tempdir / VENV_DIR).exists()
+            custom_typeshed = snapshots.snapshot(package.name)
+            env_vars["MYPYPATH"] = snapshots.mypypath(package.name)
+            venv_dir = _CACHED_VENVS.get(package.name, tempdir / VENV_DIR)
+            has_non_types_dependencies = venv_dir.exists()
             if has_non_types_dependencies:
-                python_exe = str(venv_python(tempdir / VENV_DIR))
+                python_exe = str(venv_python(venv_dir))
             else:
                 python_exe = sys.executable
                 flags.append("--no-site-packages")
 
+        description = f"{package.name}/{version}/{platform}"
+        cache_dir = tempdir / ".mypy_cache" / version / platform
+        in_worker = mypy_workers is not None and python_exe == sys.executable
+        prewarmed = False
+        if in_worker:
+            try:
+                # The cache must be built with the typeshed directory it's used with. The snapshots
+                # only exist during this run, so their caches are kept next to them rather than persistently.
+                copy_prewarmed_stdlib_cache(
+                    [*flags, "--custom-typeshed-dir", str(custom_typeshed)],
+                    version,
+                    cache_dir,
+                    directory=STDLIB_CACHE_DIR if package.is_stdlib else snapshots.directory / "mypy-stdlib",
+                )
+                prewarmed = True
+            except RuntimeError as e:
+                _PRINT_QUEUE.put(colored(f"{description}: {e}", "red"))
+        if prewarmed:
+            # No other mypy run uses this copy of the cache, so it's safe to run incrementally
+            flags.extend(["--no-sqlite-cache", "--cache-dir", str(cache_dir)])
+        else:
+            # Avoid race conditions when using the cache
+            # https://github.com/python/mypy/issues/13916
+            flags.extend(["--no-incremental", "--cache-dir", str(cache_dir)])
         flags.extend(["--custom-typeshed-dir", str(custom_typeshed)])
 
-        # If the test-case filename ends with e.g. -py314,
-        # only run the test if --python-version was set to 3.14 or higher (for example)
-        files: list[str] = []
-        for path in new_test_case_dir.rglob("*.py"):
-            if match := re.fullmatch(r".*-py3(\d\d)", path.stem):
-                minor_version_required = int(match[1])
-                assert f"3.{minor_version_required}" in SUPPORTED_VERSIONS
-                python_minor_version = int(version.split(".")[1])
-                if minor_version_required > python_minor_version:
-                    continue
-            files.append(str(path))
-
         if len(files) == 0:
             return None
 
         mypy_command = [python_exe, "-m", "mypy", *flags, *files]
         if verbosity is Verbosity.VERBOSE:
-            description = f"{package.name}/{version}/{platform}"
             msg = f"{description}: {mypy_command=}\n"
             if "MYPYPATH" in env_vars:
                 msg += f"{description}: {env_vars['MYPYPATH']=}"
             else:
                 msg += f"{description}: MYPYPATH not set"
+            if in_worker:
+                msg += f"\n{description}: running mypy in a fork-server worker"
             msg += "\n"
             verbose_log(msg)
-        return subprocess.run(mypy_command, capture_output=True, text=True, env=env_vars, check=False)
+        if in_worker:
+            assert mypy_workers is not None
+            future = mypy_workers.submit(run_mypy_in_worker, [*flags, *files], env_vars.get("MYPYPATH"))
+            stdout, stderr, returncode = future.result()
+            return MeasuredProcess(mypy_command, returncode, stdout, stderr, usage=None)
+        return run_measured(mypy_command, env=env_vars)
 
 
 @dataclass(frozen=True)
@@ -275,6 +446,19 @@ class RunResult(Result):
                 print_error(self.stdout, fix_path=replacements)
 
 
+@dataclass(frozen=True)
+class CachedResult(Result):
+    package: str
+    version: str
+    platform: str
+
+    @override
+    def print_description(self, verbosity: Verbosity) -> None:
+        if verbosity is Verbosity.VERBOSE:
+            msg = f"Test cases for {self.package!r} on Python {self.version} for platform {self.platform!r} passed (cached)."
+            print(colored(msg, "green"))
+
+
 @dataclass(frozen=True)
 class NoTestsResult(Result):
     package: str
@@ -288,17 +472,88 @@ class NoTestsResult(Result):
 
 
 def test_testcase_directory(
-    package: DistributionTests, version: str, platform: str, *, verbosity: Verbosity, tempdir: Path
+    package: DistributionTests,
+    version: str,
+    platform: str,
+    *,
+    verbosity: Verbosity,
+    tempdir: Path,
+    snapshots: TypeshedSnapshots,
+    result_cache: ResultCache | None = None,
+    timings: Timings | None = None,
+    report: Report | None = None,
+    memory_budget: MemoryBudget | None = None,
+    mypy_workers: concurrent.futures.Executor | None = None,
 ) -> Result:
+    files = testcase_files(tempdir / TEST_CASES_DIR, version)
+    # The result of each test case file is cached separately,
+    # so that editing one test case doesn't mean checking all the others again
+    cache_keys: dict[str, str] = {}
+    cached_files = 0
+    if result_cache is not None:
+        closure_digest = stub_closure_digest(None if package.is_stdlib else package.name)
+        for file in files:
+            relative_path = Path(file).relative_to(tempdir / TEST_CASES_DIR).as_posix()
+            file_digest = hashlib.sha256(Path(file).read_bytes()).hexdigest()
+            cache_keys[file] = result_cache.key(package.name, relative_path, file_digest, closure_digest, version, platform)
+        uncached_files = [file for file in files if not result_cache.is_success(cache_keys[file])]
+        cached_files = len(files) - len(uncached_files)
+        if files and not uncached_files:
+            if report is not None:
+                report.add(package.name, version, platform, "success", files=cached_files, cached=True)
+            return CachedResult(0, package.name, version, platform)
+        files = uncached_files
+
     msg = f"mypy --platform {platform} --python-version {version} on the "
     msg += "standard library test cases" if package.is_stdlib else f"test cases for {package.name!r}"
     if verbosity > Verbosity.QUIET:
-        _PRINT_QUEUE.put(f"Running {msg}...")
-
-    proc_info = run_testcases(package=package, version=version, platform=platform, tempdir=tempdir, verbosity=verbosity)
+        skipped = f" (skipping {cached_files} unchanged test case files that passed before)" if cached_files else ""
+        _PRINT_QUEUE.put(f"Running {msg}{skipped}...")
+
+    with memory_budget.reserve(package.name) if memory_budget is not None else nullcontext():
+        start = time.perf_counter()
+        proc_info = run_testcases(
+            package=package,
+            version=version,
+            platform=platform,
+            tempdir=tempdir,
+            snapshots=snapshots,
+            files=files,
+            verbosity=verbosity,
+            mypy_workers=mypy_workers,
+        )
+        wall_time = time.perf_counter() - start
+    # A run that only checks some of the files would make the package look faster than it is
+    if timings is not None and not cached_files:
+        timings.record(package.name, wall_time)
+    if memory_budget is not None and proc_info is not None and proc_info.usage is not None:
+        memory_budget.peak_memory.record(package.name, proc_info.usage.peak_rss)
     if proc_info is None:
+        if report is not None:
+            report.add(package.name, version, platform, "skipped", output="no test cases")
         return NoTestsResult(0, package.name, version, platform)
 
+    if report is not None:
+        status: TaskStatus = "success" if proc_info.returncode == 0 else "failure" if proc_info.returncode == 1 else "crash"
+        report.add(
+            package.name,
+            version,
+            platform,
+            status,
+            exit_code=proc_info.returncode,
+            files=len(files),
+            wall_time=wall_time,
+            usage=proc_info.usage,
+            output=proc_info.stdout + proc_info.stderr,
+        )
+
+    if result_cache is not None and proc_info.returncode == 0:
+        for file in files:
+            test_case = Path(file).relative_to(tempdir / TEST_CASES_DIR).as_posix()
+            result_cache.record_success(
+                cache_keys[file], package=package.name, version=version, platform=platform, test_case=test_case
+            )
+
     return RunResult(
         code=proc_info.returncode,
         command_run=msg,
@@ -328,39 +583,119 @@ def concurrently_run_testcases(
     verbosity: Verbosity,
     platforms_to_test: list[str],
     versions_to_test: list[str],
+    result_cache: ResultCache | None = None,
+    timings: Timings | None = None,
+    report: Report | None = None,
+    venv_cache: VenvCache | None = None,
+    uv_cache: UvCache | None = None,
+    memory_budget: MemoryBudget | None = None,
+    *,
+    collapse_platforms: bool = False,
+    mypy_workers: concurrent.futures.Executor | None = None,
+    num_shards: int = 1,
+    shard_index: int = 0,
 ) -> list[Result]:
-    packageinfo_to_tempdir = {
-        distribution_info: Path(stack.enter_context(tempfile.TemporaryDirectory())) for distribution_info in testcase_directories
-    }
-    to_do: list[Callable[[], Result]] = []
-    for testcase_dir, tempdir in packageinfo_to_tempdir.items():
+    tasks: list[tuple[DistributionTests, str, str]] = []
+
+    def report_skipped(package: str, versions: list[str], reason: str, platforms: list[str] = platforms_to_test) -> None:
+        if report is not None:
+            for version, platform in product(versions, platforms):
+                report.add(package, version, platform, "skipped", output=reason)
+
+    collapsed = 0
+
+    for testcase_dir in testcase_directories:
         pkg = testcase_dir.name
         requires_python = None
         if not testcase_dir.is_stdlib:
             if PYTHON_VERSION == "3.15" and pkg in PY315_INCOMPATIBLE_RUNTIME_DEPENDENCIES:
                 msg = f"skipping {pkg!r} test cases (runtime dependencies do not support 3.15 yet)"
                 print(colored(msg, "yellow"))
+                report_skipped(pkg, versions_to_test, msg)
                 continue
             requires_python = read_metadata(pkg).requires_python
             if not requires_python.contains(PYTHON_VERSION):
                 msg = f"skipping {pkg!r} (requires Python {requires_python}; test is being run using Python {PYTHON_VERSION})"
                 print(colored(msg, "yellow"))
+                report_skipped(pkg, versions_to_test, msg)
                 continue
+        platforms = platforms_to_test
+        # Packages are only collapsed onto a platform that is being tested, so that they're still tested at all
+        if (
+            collapse_platforms
+            and not testcase_dir.is_stdlib
+            and COLLAPSED_PLATFORM in platforms_to_test
+            and platforms_to_test != [COLLAPSED_PLATFORM]
+        ):
+            sensitivity = platform_sensitivity(pkg, sorted(testcase_dir.test_cases_path.rglob("*.py")))
+            if verbosity is Verbosity.VERBOSE:
+                print(colored(sensitivity.describe(), "blue"))
+            if not sensitivity.sensitive:
+                collapsed += 1
+                platforms = [COLLAPSED_PLATFORM]
+                skipped_platforms = [platform for platform in platforms_to_test if platform != COLLAPSED_PLATFORM]
+                report_skipped(
+                    pkg, versions_to_test, f"{sensitivity.describe()}; only tested on {COLLAPSED_PLATFORM}", skipped_platforms
+                )
         for version in versions_to_test:
             if not testcase_dir.is_stdlib:
                 assert requires_python is not None
                 if not requires_python.contains(version):
                     msg = f"skipping {pkg!r} for target Python {version} (requires Python {requires_python})"
                     print(colored(msg, "yellow"))
+                    report_skipped(pkg, [version], msg)
                     continue
-            to_do.extend(
-                partial(test_testcase_directory, testcase_dir, version, platform, verbosity=verbosity, tempdir=tempdir)
-                for platform in platforms_to_test
+            tasks.extend((testcase_dir, version, platform) for platform in platforms)
+
+    if collapsed and verbosity is not Verbosity.QUIET:
+        plural = "" if collapsed == 1 else "s"
+        print(
+            colored(
+                f"{collapsed} package{plural} that don't depend on the platform are only tested on {COLLAPSED_PLATFORM}", "blue"
             )
+        )
+
+    if num_shards != 1:
+        # All test runs of a package are in the same shard, so that each package is only set up by one shard
+        runs_per_package = Counter(package for package, _, _ in tasks)
+
+        def package_weight(package: DistributionTests) -> float:
+            return runs_per_package[package] * (timings.estimate(package.name) if timings else 1.0)
+
+        packages_in_shard = set(shard(list(runs_per_package), num_shards, shard_index, package_weight))
+        tasks = [task for task in tasks if task[0] in packages_in_shard]
+        if verbosity is not Verbosity.QUIET:
+            packages = f"{len(packages_in_shard)} package{'' if len(packages_in_shard) == 1 else 's'}"
+            msg = f"Running {len(tasks)} test runs of {packages} in shard {shard_index} of {num_shards}"
+            print(colored(msg, "blue"))
 
-    if not to_do:
+    if not tasks:
         return []
 
+    # Only the packages with test runs in this shard are set up
+    packageinfo_to_tempdir = {
+        package: Path(stack.enter_context(tempfile.TemporaryDirectory())) for package in dict.fromkeys(task[0] for task in tasks)
+    }
+    # Shared by all versions and platforms
+    snapshots = TypeshedSnapshots(Path(stack.enter_context(tempfile.TemporaryDirectory())))
+    to_do = [
+        partial(
+            test_testcase_directory,
+            package,
+            version,
+            platform,
+            verbosity=verbosity,
+            tempdir=packageinfo_to_tempdir[package],
+            snapshots=snapshots,
+            result_cache=result_cache,
+            timings=timings,
+            report=report,
+            memory_budget=memory_budget,
+            mypy_workers=mypy_workers,
+        )
+        for package, version, platform in tasks
+    ]
+
     @contextmanager
     def cleanup_threads(
         event: threading.Event, printer_thread: threading.Thread, executor: concurrent.futures.ThreadPoolExecutor
@@ -383,7 +718,7 @@ def concurrently_run_testcases(
         # must make sure that they're all setup correctly before starting the next step,
         # in order to avoid race conditions
         testcase_futures = [
-            executor.submit(setup_testcase_dir, package, tempdir, verbosity)
+            executor.submit(setup_testcase_dir, package, tempdir, verbosity, snapshots, venv_cache, uv_cache)
             for package, tempdir in packageinfo_to_tempdir.items()
         ]
 
@@ -391,10 +726,12 @@ def concurrently_run_testcases(
             for future in concurrent.futures.as_completed(testcase_futures):
                 future.result()
 
-        mypy_futures = [executor.submit(task) for task in to_do]
+        # Start the slowest tasks first, so that they don't end up at the tail of the queue
+        schedule = to_do if timings is None else longest_first(to_do, lambda task: timings.estimate(task.args[0].name))
+        mypy_futures = {task: executor.submit(task) for task in schedule}
 
         with cleanup_threads(event, printer_thread, executor):
-            results = [future.result() for future in mypy_futures]
+            results = [mypy_futures[task].result() for task in to_do]
 
     event.set()
     printer_thread.join()
@@ -416,12 +753,73 @@ def main() -> ReturnCode:
         platforms_to_test = args.platforms_to_test or [sys.platform]
         versions_to_test = args.versions_to_test or [PYTHON_VERSION]
 
+    if args.fork_server and "forkserver" not in multiprocessing.get_all_start_methods():
+        parser.error("--fork-server is not available on this platform")
+
+    if args.num_shards < 1:
+        parser.error(f"--num-shards must be positive, not {args.num_shards}")
+    if not 0 <= args.shard_index < args.num_shards:
+        parser.error(f"--shard-index must be between 0 and {args.num_shards - 1}, not {args.shard_index}")
+
+    if args.changed_since is not None:
+        try:
+            changed = changed_targets(args.changed_since)
+        except RuntimeError as e:
+            parser.error(str(e))
+        print(colored(f"Testing changes since {args.changed_since}: {changed.describe()}", "blue"))
+        testcase_directories = [
+            package
+            for package in testcase_directories
+            if (changed.includes_stdlib_tests() if package.is_stdlib else changed.includes_distribution(package.name))
+        ]
+        if not testcase_directories:
+            print(colored("No test cases to run for these changes.", "green"))
+            return 0
+
     results: list[Result] | None = None
 
     with ExitStack() as stack:
-        results = concurrently_run_testcases(stack, testcase_directories, verbosity, platforms_to_test, versions_to_test)
+        result_cache = ResultCache(Path(__file__)) if args.result_cache else None
+        timings = Timings("regr_test")
+        report = Report("regr_test") if args.report or args.junit_xml else None
+        uv_cache = UvCache()
+        venv_cache = stack.enter_context(VenvCache(uv_cache=uv_cache)) if args.venv_cache else None
+        peak_memory = PeakMemory("regr_test")
+        memory_budget = MemoryBudget(args.max_memory, peak_memory)
+        mypy_workers = None
+        if args.fork_server:
+            context = multiprocessing.get_context("forkserver")
+            # Imported once by the server, and inherited by every worker that it forks
+            context.set_forkserver_preload(["mypy.api", "ts_utils.mypy"])
+            mypy_workers = stack.enter_context(
+                concurrent.futures.ProcessPoolExecutor(max_workers=os.cpu_count(), mp_context=context)
+            )
+        results = concurrently_run_testcases(
+            stack,
+            testcase_directories,
+            verbosity,
+            platforms_to_test,
+            versions_to_test,
+            result_cache,
+            timings,
+            report,
+            venv_cache,
+            uv_cache,
+            memory_budget,
+            collapse_platforms=args.collapse_platforms,
+            mypy_workers=mypy_workers,
+            num_shards=args.num_shards,
+            shard_index=args.shard_index,
+        )
+        timings.save()
+        peak_memory.save()
+        if report is not None:
+            report.write(args.report, args.junit_xml)
 
     assert results is not None
+    if not results and args.num_shards != 1:
+        print(colored(f"Nothing to test in shard {args.shard_index}.", "green"))
+        return 0
     if not results:
         print_error("All tests were skipped!")
         return 1
@@ -438,6 +836,8 @@ def main() -> ReturnCode:
     else:
         print(colored("Test completed successfully!", "green"))
 
+    if uv_cache.installs:
+        print(uv_cache.summary())
     return code
 
 
@@ -9,15 +9,18 @@ In typeshed CI, we run stubtest with each currently supported Python minor versi
 
 from __future__ import annotations
 
+import argparse
 import subprocess
 import sys
+import time
 from pathlib import Path
 
 from ts_utils.paths import TS_BASE_PATH, allowlists_path
-from ts_utils.utils import allowlist_stubtest_arguments
+from ts_utils.report import Report, run_measured
+from ts_utils.utils import PYTHON_VERSION, allowlist_stubtest_arguments
 
 
-def run_stubtest(typeshed_dir: Path) -> int:
+def run_stubtest(typeshed_dir: Path, report: Report | None = None) -> int:
     # Note when stubtest imports distutils, it will likely actually import setuptools._distutils
     # This is fine because we don't care about distutils and allowlist all errors from it
     # https://github.com/python/typeshed/pull/10253#discussion_r1216712404
@@ -34,8 +37,21 @@ def run_stubtest(typeshed_dir: Path) -> int:
         *allowlist_stubtest_arguments("stdlib"),
     ]
     print(" ".join(cmd), file=sys.stderr)
+    start = time.perf_counter()
+    result = run_measured(cmd, capture_output=False)
+    if report is not None:
+        report.add(
+            "stdlib",
+            PYTHON_VERSION,
+            sys.platform,
+            "success" if result.returncode == 0 else "failure" if result.returncode == 1 else "crash",
+            exit_code=result.returncode,
+            files=sum(1 for _ in (typeshed_dir / "stdlib").rglob("*.pyi")),
+            wall_time=time.perf_counter() - start,
+            usage=result.usage,
+        )
     try:
-        subprocess.run(cmd, check=True)
+        result.check_returncode()
     except subprocess.CalledProcessError as e:
         print(
             "\nNB: stubtest output depends on the Python version (and system) it is run with. "
@@ -55,5 +71,21 @@ def run_stubtest(typeshed_dir: Path) -> int:
         return 0
 
 
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Test typeshed's stdlib using stubtest")
+    parser.add_argument(
+        "--report", type=Path, metavar="PATH", help="write a JSON report with the duration and resource usage of stubtest"
+    )
+    parser.add_argument("--junit-xml", type=Path, metavar="PATH", help="write a JUnit XML report to this file")
+    # tests/runtests.py passes the path of the stub being tested, but stubtest always checks the whole stdlib
+    parser.add_argument("paths", nargs="*", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    report = Report("stubtest_stdlib") if args.report or args.junit_xml else None
+    returncode = run_stubtest(typeshed_dir=TS_BASE_PATH, report=report)
+    if report is not None:
+        report.write(args.report, args.junit_xml)
+    return returncode
+
+
 if __name__ == "__main__":
-    sys.exit(run_stubtest(typeshed_dir=TS_BASE_PATH))
+    sys.exit(main())
@@ -15,9 +15,13 @@ from textwrap import dedent
 from time import time
 from typing import NoReturn
 
+from ts_utils.changes import changed_targets
 from ts_utils.metadata import NoSuchStubError, get_recursive_requirements, read_metadata
 from ts_utils.mypy import mypy_configuration_from_distribution, temporary_mypy_config_file
 from ts_utils.paths import STUBS_PATH, allowlists_path, tests_path
+from ts_utils.report import Report, TaskStatus, process_usage, run_measured
+from ts_utils.result_cache import RESULT_CACHE_PATH, ResultCache, distribution_digest, stdlib_digest
+from ts_utils.timings import TIMINGS_PATH, Timings, shard
 from ts_utils.utils import (
     PYTHON_VERSION,
     allowlist_stubtest_arguments,
@@ -30,9 +34,20 @@ from ts_utils.utils import (
     print_time,
     print_warning,
 )
-
-
-def run_stubtest(dist: Path, *, verbose: bool = False, ci_platforms_only: bool = False, keep_tmp_dir: bool = False) -> bool:
+from ts_utils.venvs import VENV_CACHE_PATH, VenvCache
+
+
+def run_stubtest(
+    dist: Path,
+    *,
+    verbose: bool = False,
+    ci_platforms_only: bool = False,
+    keep_tmp_dir: bool = False,
+    result_cache: ResultCache | None = None,
+    timings: Timings | None = None,
+    report: Report | None = None,
+    venv_cache: VenvCache | None = None,
+) -> bool:
     """Run stubtest for a single distribution."""
 
     dist_name = dist.name
@@ -41,61 +56,105 @@ def run_stubtest(dist: Path, *, verbose: bool = False, ci_platforms_only: bool =
 
     t = time()
 
+    def report_outcome(
+        status: TaskStatus, *, process: subprocess.CompletedProcess[str] | None = None, output: str | None = None
+    ) -> None:
+        if report is None:
+            return
+        if process is not None:
+            output = process.stdout + process.stderr
+        report.add(
+            dist_name,
+            PYTHON_VERSION,
+            sys.platform,
+            status,
+            exit_code=None if process is None else process.returncode,
+            files=sum(1 for _ in dist.rglob("*.pyi")),
+            wall_time=None if status == "skipped" else time() - t,
+            usage=None if process is None else process_usage(process),
+            cached=status == "success" and process is None,
+            output=output,
+        )
+
     stubtest_settings = metadata.stubtest_settings
+    skip_reason = None
     if stubtest_settings.skip:
-        print(colored("skipping (skip = true)", "yellow"))
+        skip_reason = "skip = true"
+    elif stubtest_settings.supported_platforms is not None and sys.platform not in stubtest_settings.supported_platforms:
+        skip_reason = "platform not supported"
+    elif ci_platforms_only and sys.platform not in stubtest_settings.ci_platforms:
+        skip_reason = "platform skipped in CI"
+    elif not metadata.requires_python.contains(PYTHON_VERSION):
+        skip_reason = f"requires Python {metadata.requires_python}"
+    if skip_reason is not None:
+        print(colored(f"skipping ({skip_reason})", "yellow"))
+        report_outcome("skipped", output=skip_reason)
         return True
 
-    if stubtest_settings.supported_platforms is not None and sys.platform not in stubtest_settings.supported_platforms:
-        print(colored("skipping (platform not supported)", "yellow"))
-        return True
-
-    if ci_platforms_only and sys.platform not in stubtest_settings.ci_platforms:
-        print(colored("skipping (platform skipped in CI)", "yellow"))
-        return True
-
-    if not metadata.requires_python.contains(PYTHON_VERSION):
-        print(colored(f"skipping (requires Python {metadata.requires_python})", "yellow"))
-        return True
-
-    tmp = tempfile.mkdtemp(prefix="stubtest-")  # TODO: Python 3.12: Use TemporaryDirectory
-    venv_dir = Path(tmp)
-    try:
-        try:
-            subprocess.run(["uv", "venv", venv_dir, "--seed"], capture_output=True, check=True)
-        except subprocess.CalledProcessError as e:
-            print_command_failure("Failed to create a virtualenv (likely a bug in uv?)", e)
-            return False
-        if sys.platform == "win32":
-            pip_exe = str(venv_dir / "Scripts" / "pip.exe")
-            python_exe = str(venv_dir / "Scripts" / "python.exe")
-        else:
-            pip_exe = str(venv_dir / "bin" / "pip")
-            python_exe = str(venv_dir / "bin" / "python")
-        dist_extras = ", ".join(stubtest_settings.extras)
-        dist_req = f"{dist_name}[{dist_extras}]{metadata.version_spec}"
-
-        requirements = get_recursive_requirements(dist_name)
-
-        # We need stubtest to be able to import the package, so install mypy into the venv
-        # Hopefully mypy continues to not need too many dependencies
-        # TODO: Maybe find a way to cache these in CI
-        dists_to_install = [dist_req, get_mypy_req()]
-        # Internal requirements are added to MYPYPATH
-        dists_to_install.extend(str(r) for r in requirements.external_pkgs)
-        dists_to_install.extend(stubtest_settings.stubtest_dependencies)
-
-        # Since the "gdb" Python package is available only inside GDB, it is not
-        # possible to install it through pip, so stub tests cannot install it.
-        if dist_name == "gdb":
-            dists_to_install[:] = dists_to_install[1:]
-
-        pip_cmd = [pip_exe, "install", *dists_to_install]
+    cache_key = None
+    if result_cache is not None:
+        cache_key = result_cache.key(dist_name, distribution_digest(dist_name), stdlib_digest(), PYTHON_VERSION, sys.platform)
+        if result_cache.is_success(cache_key):
+            print(colored("success (cached)", "green"))
+            report_outcome("success")
+            return True
+
+    dist_extras = ", ".join(stubtest_settings.extras)
+    dist_req = f"{dist_name}[{dist_extras}]{metadata.version_spec}"
+
+    requirements = get_recursive_requirements(dist_name)
+
+    # We need stubtest to be able to import the package, so install mypy into the venv
+    # Hopefully mypy continues to not need too many dependencies
+    dists_to_install = [dist_req, get_mypy_req()]
+    # Internal requirements are added to MYPYPATH
+    dists_to_install.extend(str(r) for r in requirements.external_pkgs)
+    dists_to_install.extend(stubtest_settings.stubtest_dependencies)
+
+    # Since the "gdb" Python package is available only inside GDB, it is not
+    # possible to install it through pip, so stub tests cannot install it.
+    if dist_name == "gdb":
+        dists_to_install[:] = dists_to_install[1:]
+
+    # The setup for gdb and uWSGI writes scripts into the venv, so they always get a venv of their own
+    if venv_cache is not None and dist_name not in {"gdb", "uWSGI"}:
         try:
-            subprocess.run(pip_cmd, check=True, capture_output=True)
+            venv_dir = venv_cache.get(
+                dists_to_install,
+                seed=True,
+                install=lambda venv: subprocess.run(
+                    [venv_executables(venv)[0], "install", *dists_to_install], check=True, capture_output=True
+                ),
+            )
         except subprocess.CalledProcessError as e:
-            print_command_failure("Failed to install", e)
+            print_error("fail")
+            print(f"\nFailed to set up a cached virtualenv: {e}")
+            if e.stderr:
+                print(e.stderr.decode(), end="")
+            report_outcome("crash", output=str(e))
             return False
+        temporary_venv = False
+    else:
+        venv_dir = Path(tempfile.mkdtemp(prefix="stubtest-"))  # TODO: Python 3.12: Use TemporaryDirectory
+        temporary_venv = True
+
+    pip_exe, python_exe = venv_executables(venv_dir)
+    pip_cmd = [pip_exe, "install", *dists_to_install]
+    try:
+        if temporary_venv:
+            try:
+                subprocess.run(["uv", "venv", venv_dir, "--seed"], capture_output=True, check=True)
+            except subprocess.CalledProcessError as e:
+                print_command_failure("Failed to create a virtualenv (likely a bug in uv?)", e)
+                report_outcome("crash", output=e.stderr.decode())
+                return False
+
+            try:
+                subprocess.run(pip_cmd, check=True, capture_output=True)
+            except subprocess.CalledProcessError as e:
+                print_command_failure("Failed to install", e)
+                report_outcome("crash", output=e.stderr.decode())
+                return False
 
         mypy_configuration = mypy_configuration_from_distribution(dist_name)
         with temporary_mypy_config_file(mypy_configuration, stubtest_settings) as temp:
@@ -145,10 +204,14 @@ def run_stubtest(dist: Path, *, verbose: bool = False, ci_platforms_only: bool =
                 if not setup_gdb_stubtest_command(venv_dir, stubtest_cmd):
                     return False
 
+            stubtest_result = run_measured(stubtest_cmd, env=stubtest_env)
+            report_outcome("success" if stubtest_result.returncode == 0 else "failure", process=stubtest_result)
             try:
-                subprocess.run(stubtest_cmd, env=stubtest_env, check=True, capture_output=True)
+                stubtest_result.check_returncode()
             except subprocess.CalledProcessError as e:
                 print_time(time() - t)
+                if timings is not None:
+                    timings.record(dist_name, time() - t)
                 print_error("fail")
 
                 print_divider()
@@ -191,16 +254,20 @@ def run_stubtest(dist: Path, *, verbose: bool = False, ci_platforms_only: bool =
                 return False
             else:
                 print_time(time() - t)
+                if timings is not None:
+                    timings.record(dist_name, time() - t)
                 print_success_msg()
+                if result_cache is not None and cache_key is not None:
+                    result_cache.record_success(cache_key, distribution=dist_name, platform=sys.platform)
 
                 if sys.platform not in stubtest_settings.ci_platforms:
                     print_warning(f"Note: {dist_name} is not currently tested on {sys.platform} in typeshed's CI")
 
-                if keep_tmp_dir:
+                if keep_tmp_dir and temporary_venv:
                     print_info(f"Virtual environment kept at: {venv_dir}")
 
     finally:
-        if not keep_tmp_dir:
+        if temporary_venv and not keep_tmp_dir:
             rmtree(venv_dir)
 
     if verbose:
@@ -209,6 +276,13 @@ def run_stubtest(dist: Path, *, verbose: bool = False, ci_platforms_only: bool =
     return True
 
 
+def venv_executables(venv_dir: Path) -> tuple[str, str]:
+    """Return the paths to pip and python in a venv."""
+    if sys.platform == "win32":
+        return str(venv_dir / "Scripts" / "pip.exe"), str(venv_dir / "Scripts" / "python.exe")
+    return str(venv_dir / "bin" / "pip"), str(venv_dir / "bin" / "python")
+
+
 def setup_gdb_stubtest_command(venv_dir: Path, stubtest_cmd: list[str]) -> bool:
     """
     Use wrapper scripts to run stubtest inside gdb.
@@ -388,14 +462,19 @@ def print_command_failure(message: str, e: subprocess.CalledProcessError) -> Non
 
 
 def print_command_output(e: subprocess.CalledProcessError | subprocess.CompletedProcess[bytes]) -> None:
-    print(e.stdout.decode(), end="")
-    print(e.stderr.decode(), end="")
+    for output in (e.stdout, e.stderr):
+        print(output if isinstance(output, str) else output.decode(), end="")
 
 
 def main() -> NoReturn:
     parser = argparse.ArgumentParser()
     parser.add_argument("-v", "--verbose", action="store_true", help="verbose output")
-    parser.add_argument("--num-shards", type=int, default=1)
+    parser.add_argument(
+        "--num-shards",
+        type=int,
+        default=1,
+        help=f"split the distributions into shards of similar total runtime, based on the durations in {TIMINGS_PATH}",
+    )
     parser.add_argument("--shard-index", type=int, default=0)
     parser.add_argument(
         "--ci-platforms-only",
@@ -403,6 +482,37 @@ def main() -> NoReturn:
         help="skip the test if the current platform is not specified in METADATA.toml/tool.stubtest.ci-platforms",
     )
     parser.add_argument("--keep-tmp-dir", action="store_true", help="keep the temporary virtualenv")
+    parser.add_argument(
+        "--venv-cache",
+        action="store_true",
+        help=(
+            f"keep the virtualenvs in {VENV_CACHE_PATH} and reuse them in later runs, instead of using temporary ones; "
+            "note that new upstream releases are not installed into existing virtualenvs"
+        ),
+    )
+    parser.add_argument(
+        "--result-cache",
+        action="store_true",
+        help=(
+            "skip distributions whose stubs haven't changed since stubtest last passed on them "
+            f"(stored in {RESULT_CACHE_PATH}); note that new upstream releases are not detected"
+        ),
+    )
+    parser.add_argument(
+        "--report",
+        type=Path,
+        metavar="PATH",
+        help="write a JSON report with the outcome, duration and resource usage of every distribution to this file",
+    )
+    parser.add_argument("--junit-xml", type=Path, metavar="PATH", help="write a JUnit XML report to this file")
+    parser.add_argument(
+        "--changed-since",
+        metavar="REV",
+        help=(
+            "only test the distributions changed since the merge base of this git revision, "
+            "and the distributions that depend on them"
+        ),
+    )
     parser.add_argument("dists", metavar="DISTRIBUTION", type=str, nargs=argparse.ZERO_OR_MORE)
     args = parser.parse_args()
 
@@ -411,17 +521,45 @@ def main() -> NoReturn:
     else:
         dists = [STUBS_PATH / d for d in args.dists]
 
+    if args.changed_since is not None:
+        try:
+            changed = changed_targets(args.changed_since)
+        except RuntimeError as e:
+            parser.error(str(e))
+        print_info(f"Testing changes since {args.changed_since}: {changed.describe()}")
+        dists = [dist for dist in dists if changed.includes_distribution(dist.name)]
+
+    # Durations differ a lot between platforms, so CI runs on different platforms can share a timings file
+    timings = Timings(f"stubtest_third_party-{sys.platform}")
+    try:
+        dists = shard(dists, args.num_shards, args.shard_index, lambda dist: timings.estimate(dist.name))
+    except ValueError as e:
+        parser.error(str(e))
+
+    result_cache = ResultCache(Path(__file__)) if args.result_cache else None
+    report = Report("stubtest_third_party") if args.report or args.junit_xml else None
+    venv_cache = VenvCache() if args.venv_cache else None
     result = 0
-    for i, dist in enumerate(dists):
-        if i % args.num_shards != args.shard_index:
-            continue
+    for dist in dists:
         try:
             if not run_stubtest(
-                dist, verbose=args.verbose, ci_platforms_only=args.ci_platforms_only, keep_tmp_dir=args.keep_tmp_dir
+                dist,
+                verbose=args.verbose,
+                ci_platforms_only=args.ci_platforms_only,
+                keep_tmp_dir=args.keep_tmp_dir,
+                result_cache=result_cache,
+                timings=timings,
+                report=report,
+                venv_cache=venv_cache,
             ):
                 result = 1
         except NoSuchStubError as e:
             parser.error(str(e))
+    if venv_cache is not None:
+        venv_cache.close()
+    timings.save()
+    if report is not None:
+        report.write(args.report, args.junit_xml)
     sys.exit(result)
 
 